@@ -14,11 +14,79 @@ from pyclibrary import CParser
 __all__ = ['MID','CC','MSG']
 
 
-class MessageIDDB(object):
+class LayeredDict(object):
+    """
+    a dictionary which falls back to a shared base dictionary
+
+    Lookups which miss the local layer are forwarded to the base. Writes only
+    ever go to the local layer, so the base can be shared by several layers
+    without being copied or modified.
+    """
+    def __init__(self, base=None):
+        self._local = {}
+        self._base = base if base is not None else {}
+
+    def __getitem__(self, key):
+        if key in self._local:
+            return self._local[key]
+        return self._base[key]
+
+    def __setitem__(self, key, value):
+        self._local[key] = value
+
+    def __contains__(self, key):
+        return key in self._local or key in self._base
+
+    def __iter__(self):
+        for k in self._local:
+            yield k
+        for k in self._base:
+            if k not in self._local:
+                yield k
+
+    def __len__(self):
+        return len(self._local) + len([k for k in self._base if k not in self._local])
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def keys(self):
+        return list(iter(self))
+
+    def values(self):
+        return [self[k] for k in self]
+
+    def items(self):
+        return [(k, self[k]) for k in self]
+
+
+class LayeredDB(object):
+    """
+    base class for definition databases which can be layered on top of a
+    shared base database
+    """
+    def __init__(self, base=None):
+        self._base = base
+        self._fw = LayeredDict(base._fw if base is not None else None)
+
+    def __getattr__(self, name):
+        # Only called when the attribute isn't defined on this layer
+        base = self.__dict__.get('_base', None)
+        if base is None or name.startswith('__'):
+            raise AttributeError(name)
+        return getattr(base, name)
+
+    def __dir__(self):
+        names = set(dir(type(self))) | set(self.__dict__)
+        if self._base is not None:
+            names |= set(dir(self._base))
+        return sorted(names)
+
+class MessageIDDB(LayeredDB):
     """Message ID Database"""
-    def __init__(self):
-        self._fw = {}
-        self._inv = {}
+    def __init__(self, base=None):
+        super(MessageIDDB, self).__init__(base)
+        self._inv = LayeredDict(base._inv if base is not None else None)
 
     def add(self,name,mid):
         if name in self._fw:
@@ -31,11 +99,8 @@ class MessageIDDB(object):
     def inv(self,mid):
         return self._inv.get(mid,None)
 
-class CommandCodeDB(object):
+class CommandCodeDB(LayeredDB):
     """Command Code Database"""
-    def __init__(self):
-        self._fw = {}
-
     def add(self,name,cc):
         if name in self._fw:
             print('WARNING: {} already defined as {}'.format(name,
@@ -46,11 +111,8 @@ class CommandCodeDB(object):
     def inv(self,cc):
         return [(k,v) for k,v in self._fw.items() if v == cc]
 
-class MessageStructDB(object):
+class MessageStructDB(LayeredDB):
     """Message Struct Database"""
-    def __init__(self):
-        self._fw = {}
-
     def add(self,name,spec):
         if name in self._fw:
             print('WARNING: {} already defined as {}'.format(name,
@@ -59,9 +121,13 @@ class MessageStructDB(object):
         setattr(self,name,spec)
 
 
-def load_headers(headers, verbose=False, cache_file_path=None):
+def load_headers(headers, verbose=False, cache_file_path=None, base=None):
     """
     load data from a set of cFS message / id headers
+
+    base: optional (mid, cc, msg, parser) tuple returned by a previous call.
+        The definitions parsed from `headers` are layered on top of it without
+        re-parsing or copying the base databases.
     """
     print("Loading definitions from headers:")
     for header in headers:
@@ -71,34 +137,52 @@ def load_headers(headers, verbose=False, cache_file_path=None):
     logging.getLogger('pyclibrary.c_parser').setLevel(logging.INFO)
     logging.getLogger('c_parser').setLevel(logging.INFO)
 
+    if base is not None:
+        base_mid, base_cc, base_msg, base_parser = base
+        copy_from = base_parser
+    else:
+        base_mid, base_cc, base_msg, base_parser = None, None, None, None
+        copy_from = None
+
     if cache_file_path:
-        parser = CParser(headers, process_all=False, cache=text(cache_file_path))
+        parser = CParser(headers, copy_from=copy_from, process_all=False,
+                cache=text(cache_file_path))
     else:
-        parser = CParser(headers, process_all=False)
+        parser = CParser(headers, copy_from=copy_from, process_all=False)
 
     parser.process_all(cache=text(cache_file_path),
             print_after_preprocess=False)
 
-    mid = MessageIDDB()
-    cc = CommandCodeDB()
-    msg = MessageStructDB()
+    mid = MessageIDDB(base_mid)
+    cc = CommandCodeDB(base_cc)
+    msg = MessageStructDB(base_msg)
+
+    def in_base(base_db, name, value):
+        # Definitions copied from the base parser are already in the base
+        # databases, redefinitions are added to this layer with a warning
+        return base_db is not None and name in base_db._fw and base_db._fw[name] == value
 
     for k,v in parser.defs['values'].items():
-        if k.endswith('_MID'):
+        if k.endswith('_MID') and not in_base(base_mid, k, v):
             mid.add(k,v)
-        if k.endswith('_CC'):
+        if k.endswith('_CC') and not in_base(base_cc, k, v):
             cc.add(k,v)
 
     for k,v in parser.defs['types'].items():
 
         struct_name = v.type_spec.split(' ')
 
-        if len(struct_name) == 2:
-            if struct_name[1] in parser.defs['structs']:
-                struct_data = parser.defs['structs'][struct_name[1]]
-                msg.add( k, struct_data)
+        if len(struct_name) == 2 and struct_name[1] in parser.defs['structs']:
+            spec = parser.defs['structs'][struct_name[1]]
+        elif any(isinstance(d, list) for d in v.declarators):
+            # Keep the dimensions of array typedefs, but not the names of
+            # enum / struct / union tag entries like Type('enum', 'Color')
+            spec = v
         else:
-            msg.add(k, v.type_spec)
+            spec = v.type_spec
+
+        if not in_base(base_msg, k, spec):
+            msg.add(k, spec)
 
     if verbose:
         print('Loaded MIDs:')
@@ -118,15 +202,8 @@ def load_headers(headers, verbose=False, cache_file_path=None):
 
     return (mid,cc,msg,parser)
 
-def load_bundle(bundle_path, mission, target, apps, verbose=False, use_cache=False):
-    # get the bundle
-    if bundle_path is None:
-        bundle_path = os.getcwd()
-
-    # Stable order to avoid unnecessary reloading
-    apps = sorted(apps)
-
-    # get the mission
+def get_mission(bundle_path, mission):
+    """determine the mission name for a bundle"""
     if mission is None:
 
         mission_directories = sorted(
@@ -141,7 +218,11 @@ def load_bundle(bundle_path, mission, target, apps, verbose=False, use_cache=Fal
         print("Could not determine mission.")
         sys.exit(1)
 
-    # Get mission headers
+    return mission
+
+def get_core_headers(bundle_path, mission):
+    """get the mission and cFE headers which are shared by all targets"""
+
     mission_dir = os.path.join(bundle_path,mission+'_defs')
     mission_cfg = '{}_mission_cfg.h'.format(mission)
 
@@ -149,7 +230,23 @@ def load_bundle(bundle_path, mission, target, apps, verbose=False, use_cache=Fal
             os.path.join(mission_dir,mission_cfg),
             ]
 
-    # Get target headers
+    headers.append(os.path.join(bundle_path,'cfe','fsw','cfe-core','src','inc','cfe_es_extern_typedefs.h'))
+    headers.append(os.path.join(bundle_path,'cfe','fsw','cfe-core','src','inc','cfe_evs_extern_typedefs.h'))
+    headers.append(os.path.join(bundle_path,'cfe','fsw','cfe-core','src','inc','cfe_tbl_extern_typedefs.h'))
+    headers.append(os.path.join(bundle_path,'cfe','fsw','cfe-core','src','inc','cfe_sb_extern_typedefs.h'))
+    headers.append(os.path.join(bundle_path,'cfe','fsw','cfe-core','src','inc','cfe_sb.h'))
+
+    headers.extend(find_msg_headers([os.path.join(bundle_path,'cfe','fsw')]))
+
+    return headers
+
+def get_target_headers(bundle_path, mission, target, apps):
+    """get the message id and app headers for a given target"""
+
+    mission_dir = os.path.join(bundle_path,mission+'_defs')
+
+    headers = []
+
     msgids_paths = []
     if target is not None:
         msgids_paths.append(os.path.join(mission_dir,'{}_msgids.h'.format(target)))
@@ -160,36 +257,25 @@ def load_bundle(bundle_path, mission, target, apps, verbose=False, use_cache=Fal
             headers.append(path)
             break
 
-    headers.append(os.path.join(bundle_path,'cfe','fsw','cfe-core','src','inc','cfe_es_extern_typedefs.h'))
-    headers.append(os.path.join(bundle_path,'cfe','fsw','cfe-core','src','inc','cfe_evs_extern_typedefs.h'))
-    headers.append(os.path.join(bundle_path,'cfe','fsw','cfe-core','src','inc','cfe_tbl_extern_typedefs.h'))
-    headers.append(os.path.join(bundle_path,'cfe','fsw','cfe-core','src','inc','cfe_sb_extern_typedefs.h'))
-    headers.append(os.path.join(bundle_path,'cfe','fsw','cfe-core','src','inc','cfe_sb.h'))
+    headers.extend(find_msg_headers(
+        [os.path.join(bundle_path,'apps',app,'fsw') for app in sorted(apps)]))
+
+    return headers
 
-    # Get app headers
-    search_paths = (
-            [os.path.join(bundle_path,'apps',app,'fsw') for app in apps] +
-            [os.path.join(bundle_path,'cfe','fsw')])
+def find_msg_headers(search_paths):
+    """find message and perf id headers under a set of directories"""
+    headers = []
     for path in search_paths:
         for root, dirs, files in os.walk(path):
             for filename in files:
                 if filename.endswith('.h') and ('msg' in filename or 'perfids' in filename):
                     headers.append(os.path.join(root,filename))
+    return headers
 
-    # Define cache directory
-    cache_path = os.path.join(
-            mission_dir,
-            '{}-pycfs.cache'.format(target))
-    print("Using cache path: {}".format(cache_path))
-    try:
-        os.makedirs(cache_path)
-    except:
-        pass
+def get_include_args(bundle_path, mission, headers):
+    """get the gcc include arguments needed to preprocess a set of headers"""
 
-    if use_cache:
-        cache_file_path = os.path.join(cache_path,'cache')
-    else:
-        cache_file_path = None
+    mission_dir = os.path.join(bundle_path,mission+'_defs')
 
     include_paths = [['-I',os.path.dirname(h)] for h in headers]
     for root, dirs, files in os.walk(os.path.join(bundle_path,'build',mission)):
@@ -206,6 +292,36 @@ def load_bundle(bundle_path, mission, target, apps, verbose=False, use_cache=Fal
             +['-I',os.path.join(bundle_path,'build',mission,'inc')]
             +['-I',mission_dir])
 
+    return include_args
+
+def get_cache_paths(bundle_path, mission, name, use_cache):
+    """get the preprocessor output directory and parser cache file"""
+
+    mission_dir = os.path.join(bundle_path,mission+'_defs')
+
+    # Define cache directory
+    cache_path = os.path.join(
+            mission_dir,
+            '{}-pycfs.cache'.format(name))
+    print("Using cache path: {}".format(cache_path))
+    try:
+        os.makedirs(cache_path)
+    except:
+        pass
+
+    if use_cache:
+        cache_file_path = os.path.join(cache_path,'cache')
+    else:
+        cache_file_path = None
+
+    return cache_path, cache_file_path
+
+def preprocess_headers(headers, include_args, cache_path, cache_file_path):
+    """
+    run each header through the preprocessor, keeping only the definitions
+    from the header itself
+    """
+
     # For each header, run `gcc -E` to get preproc output (processing #include
     # directives etc)
     processed_headers = []
@@ -214,7 +330,7 @@ def load_bundle(bundle_path, mission, target, apps, verbose=False, use_cache=Fal
         processed_header_defines = os.path.join(cache_path, header[1:]+'.def')
         processed_header_expanded = os.path.join(cache_path, header[1:]+'.exp')
 
-        cache_exists = os.path.exists(cache_file_path)
+        cache_exists = cache_file_path is not None and os.path.exists(cache_file_path)
         processed_header_exists = os.path.exists(processed_header)
         processed_header_out_of_date = (
                 processed_header_exists
@@ -285,5 +401,88 @@ def load_bundle(bundle_path, mission, target, apps, verbose=False, use_cache=Fal
 
         processed_headers.append(processed_header)
 
+    return processed_headers
+
+def load_bundle(bundle_path, mission, target, apps, verbose=False, use_cache=False):
+    # get the bundle
+    if bundle_path is None:
+        bundle_path = os.getcwd()
+
+    # Stable order to avoid unnecessary reloading
+    apps = sorted(apps)
+
+    # get the mission
+    mission = get_mission(bundle_path, mission)
+
+    # Get mission, target and app headers
+    core_headers = get_core_headers(bundle_path, mission)
+    target_headers = get_target_headers(bundle_path, mission, target, apps)
+
+    # Keep the message ids ahead of the cFE headers
+    headers = core_headers[:1] + target_headers[:1] + core_headers[1:] + target_headers[1:]
+
+    cache_path, cache_file_path = get_cache_paths(
+            bundle_path, mission, target, use_cache)
+
+    include_args = get_include_args(bundle_path, mission, headers)
+
+    processed_headers = preprocess_headers(
+            headers, include_args, cache_path, cache_file_path)
+
     return load_headers(processed_headers, verbose=verbose, cache_file_path=cache_file_path)
 
+def load_bundles(bundle_path, mission, targets, verbose=False, use_cache=False):
+    """
+    load the definitions for several targets of the same bundle
+
+    targets: dict mapping each target name to its list of apps
+
+    The mission and cFE core headers are preprocessed and parsed once. The
+    message ids and app definitions for each target are layered on top of
+    these shared definitions, so they are not copied for every target. A
+    target which redefines a shared name gets its own definition, with a
+    warning as in `load_bundle`.
+
+    Returns a dict mapping each target name to a (mid, cc, msg, parser)
+    tuple, as returned by `load_bundle`.
+    """
+    # get the bundle
+    if bundle_path is None:
+        bundle_path = os.getcwd()
+
+    # get the mission
+    mission = get_mission(bundle_path, mission)
+
+    core_headers = get_core_headers(bundle_path, mission)
+    target_headers = {
+            target: get_target_headers(bundle_path, mission, target, apps)
+            for target, apps in targets.items()}
+
+    # Use the same include paths for all headers
+    include_args = get_include_args(bundle_path, mission,
+            core_headers + [h for t in sorted(target_headers) for h in target_headers[t]])
+
+    # Load the shared definitions, caching them apart from the caches used
+    # by load_bundle since the parsed definitions differ
+    cache_path, cache_file_path = get_cache_paths(
+            bundle_path, mission, os.path.join('layered', 'core'), use_cache)
+
+    processed_headers = preprocess_headers(
+            core_headers, include_args, cache_path, cache_file_path)
+
+    core = load_headers(processed_headers, verbose=verbose,
+            cache_file_path=cache_file_path)
+
+    # Layer the target definitions on top
+    loaded = {}
+    for target in sorted(target_headers):
+        cache_path, cache_file_path = get_cache_paths(
+                bundle_path, mission, os.path.join('layered', 'targets', target), use_cache)
+
+        processed_headers = preprocess_headers(
+                target_headers[target], include_args, cache_path, cache_file_path)
+
+        loaded[target] = load_headers(processed_headers, verbose=verbose,
+                cache_file_path=cache_file_path, base=core)
+
+    return loaded
@@ -0,0 +1,196 @@
+from __future__ import print_function
+
+import sys
+import time
+import struct
+
+from .serialization import CCSDS, cFS, TelemetryFactory
+
+# Decoded strings are also shared through the decoder's string cache
+intern = getattr(sys, 'intern', lambda string: string)
+
+# ref: CFE_EVS_EventType_Enum_t
+EVENT_TYPES = {
+        1: 'DEBUG',
+        2: 'INFORMATION',
+        3: 'ERROR',
+        4: 'CRITICAL',
+        }
+
+class Event(object):
+    """a decoded cFE event message"""
+
+    __slots__ = ['stamp', 'app_name', 'event_id', 'event_type', 'text',
+            'n_suppressed']
+
+    def __init__(self, stamp, app_name, event_id, event_type, text,
+            n_suppressed=0):
+        """
+        stamp: (seconds, subseconds) from the telemetry header
+        n_suppressed: number of identical events suppressed before this one
+        """
+        self.stamp = stamp
+        self.app_name = app_name
+        self.event_id = event_id
+        self.event_type = event_type
+        self.text = text
+        self.n_suppressed = n_suppressed
+
+    def __repr__(self):
+        repeats = ' (+{} suppressed)'.format(self.n_suppressed) if self.n_suppressed else ''
+        return '{}.{:05d} {} {} {}: {}{}'.format(
+                self.stamp[0], self.stamp[1],
+                EVENT_TYPES.get(self.event_type, self.event_type),
+                self.app_name, self.event_id,
+                self.text, repeats)
+
+class EventDecoder(object):
+    """
+    fast decoder for cFE long event messages
+
+    The app name, event id, event type and text are read directly at their
+    offsets in the message, and NUL-terminated strings are trimmed without
+    decoding the rest of the message. Decoded app names and texts are
+    interned, so repeated events share the same string objects.
+
+    Identical events (same app, id, type and text) received within window
+    seconds of the last one delivered are suppressed. The next identical
+    event delivered after the window reports how many were suppressed in
+    n_suppressed, and flush() reports storms which have ended. A UDPListener
+    calls flush() periodically and delivers these events to the callbacks.
+
+    Can be used as a UDPListener decoder:
+        lsnr.listen(MID.CFE_EVS_EVENT_MSG_MID, MSG.CFE_EVS_LongEventTlm_Payload_t,
+                print, decoder=EventDecoder(MSG, MSG.CFE_EVS_LongEventTlm_Payload_t))
+    """
+
+    FIELDS = [
+            'PacketID.AppName',
+            'PacketID.EventID',
+            'PacketID.EventType',
+            'Message',
+            ]
+
+    def __init__(self, type_specs, spec, endianness='little', window=1.0,
+            max_cached_strings=4096, fields=None):
+        """
+        spec: struct specification of the long event payload, e.g.
+            CFE_EVS_LongEventTlm_Payload_t
+        window: storm suppression window in seconds, 0 to disable
+        max_cached_strings: maximum number of decoded strings to keep
+        fields: paths of the app name, event id, event type and message
+            fields in spec (default: FIELDS)
+        """
+
+        tfac = TelemetryFactory(type_specs, endianness)
+        self.projection = tfac.make_projection(spec,
+                fields if fields is not None else self.FIELDS)
+
+        self.stamp_struct = struct.Struct(cFS.TLM.SEC.FORMAT)
+
+        self.window = window
+        self.max_cached_strings = max_cached_strings
+
+        # Decoded strings by raw bytes
+        self.strings = {}
+
+        # Storms by raw event:
+        #   [time last delivered, n suppressed, stamp of last suppressed]
+        self.storms = {}
+
+        # Events of storms which ended when the storms were trimmed, kept
+        # until the next flush()
+        self.ended = []
+
+        self.n_decoded = 0
+        self.n_suppressed = 0
+
+    def decode_string(self, raw):
+        """trim, decode and intern a string"""
+
+        raw = raw.split(b'\x00', 1)[0]
+
+        string = self.strings.get(raw, None)
+        if string is None:
+            if len(self.strings) >= self.max_cached_strings:
+                self.strings.clear()
+
+            string = intern(raw.decode('utf-8', 'replace'))
+            self.strings[raw] = string
+
+        return string
+
+    def unpack(self, data, now=None):
+        """
+        decode an event message
+
+        returns an Event, or None if it was suppressed
+        """
+
+        app_name, event_id, event_type, text = self.projection.unpack(data)
+        self.n_decoded += 1
+
+        if now is None:
+            now = time.time()
+
+        if self.window > 0:
+            key = (app_name, event_id, event_type, text)
+            storm = self.storms.get(key, None)
+
+            if storm is not None and now - storm[0] < self.window:
+                storm[1] += 1
+                storm[2] = self.stamp_struct.unpack_from(data, CCSDS.PRI.SIZE)
+                self.n_suppressed += 1
+                return None
+
+            n_suppressed = storm[1] if storm is not None else 0
+            self.storms[key] = [now, 0, None]
+
+            # Trim storms which have ended, keeping their events for flush()
+            if len(self.storms) > self.max_cached_strings:
+                self.ended.extend(self.end_storms(now))
+        else:
+            n_suppressed = 0
+
+        return self.make_event(
+                self.stamp_struct.unpack_from(data, CCSDS.PRI.SIZE),
+                app_name, event_id, event_type, text, n_suppressed)
+
+    def make_event(self, stamp, app_name, event_id, event_type, text,
+            n_suppressed):
+
+        return Event(
+                stamp,
+                self.decode_string(app_name),
+                event_id,
+                event_type,
+                self.decode_string(text),
+                n_suppressed)
+
+    def flush(self, now=None):
+        """
+        end storms whose window has elapsed
+
+        returns the last suppressed Event of each storm which had
+        suppressed events, with its n_suppressed count
+        """
+
+        if now is None:
+            now = time.time()
+
+        events, self.ended = self.ended, []
+        events.extend(self.end_storms(now))
+
+        return events
+
+    def end_storms(self, now):
+        """remove the storms whose window has elapsed and get their events"""
+
+        events = []
+
+        for key in [k for k,v in self.storms.items() if now - v[0] >= self.window]:
+            delivered, n_suppressed, stamp = self.storms.pop(key)
+            if n_suppressed > 0:
+                events.append(self.make_event(stamp, *(key + (n_suppressed,))))
+
+        return events
@@ -0,0 +1,150 @@
+from __future__ import print_function
+
+import array
+import threading
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from .serialization import NUMPY_FORMATS
+
+class PacketHistory(object):
+    """
+    ring buffer of the last raw packets received for one MID
+
+    Packets are copied into fixed-size slots of a preallocated arena, with
+    their sizes and receipt times in parallel arrays, so the memory used is
+    fixed when the history is created. Packets larger than a slot are
+    truncated. Packets are only decoded when they are accessed.
+    """
+    def __init__(self, tfac, spec, depth, slot_size):
+        """
+        tfac: TelemetryFactory used to decode the packets
+        spec: struct specification of the packet payload
+        depth: number of packets to keep
+        slot_size: maximum size of a packet in bytes
+        """
+        self.tfac = tfac
+        self.spec = spec
+        self.depth = depth
+        self.slot_size = slot_size
+
+        self.arena = bytearray(depth * slot_size)
+        self.sizes = array.array('I', [0] * depth)
+        self.stamps = array.array('d', [0.0] * depth)
+
+        # Total number of packets appended
+        self.count = 0
+        self.n_truncated = 0
+
+        self.lock = threading.Lock()
+
+    @property
+    def nbytes(self):
+        return (len(self.arena)
+                + self.sizes.itemsize * len(self.sizes)
+                + self.stamps.itemsize * len(self.stamps))
+
+    def __len__(self):
+        return min(self.count, self.depth)
+
+    def append(self, data, stamp):
+        """add a packet received at time stamp"""
+
+        size = len(data)
+        if size > self.slot_size:
+            size = self.slot_size
+            self.n_truncated += 1
+
+        with self.lock:
+            slot = self.count % self.depth
+            start = slot * self.slot_size
+            self.arena[start:start + size] = memoryview(data)[0:size]
+            self.sizes[slot] = size
+            self.stamps[slot] = stamp
+            self.count += 1
+
+    def get_slots(self, n=None):
+        """get the slots of the last n packets, oldest first"""
+
+        n_stored = len(self)
+        if n is None or n > n_stored:
+            n = n_stored
+
+        return [i % self.depth for i in range(self.count - n, self.count)]
+
+    def last(self, n=None):
+        """get copies of the last n packets as (stamp, bytes), oldest first"""
+
+        with self.lock:
+            return [(self.stamps[slot],
+                bytes(self.arena[slot * self.slot_size:slot * self.slot_size + self.sizes[slot]]))
+                for slot in self.get_slots(n)]
+
+    def views(self, n=None):
+        """
+        get views of the last n packets as (stamp, memoryview), oldest
+        first
+
+        The views aren't copies, so they are overwritten once depth more
+        packets have been received.
+        """
+
+        arena = memoryview(self.arena)
+
+        with self.lock:
+            return [(self.stamps[slot],
+                arena[slot * self.slot_size:slot * self.slot_size + self.sizes[slot]])
+                for slot in self.get_slots(n)]
+
+    def cstructs(self, n=None):
+        """decode the last n packets as (stamp, CStruct), oldest first"""
+
+        return [(stamp, self.tfac.unpack_payload(data, self.spec))
+                for stamp, data in self.last(n)]
+
+    def column(self, field, n=None):
+        """
+        get the stamps and values of one field in the last n packets,
+        oldest first
+
+        Returns a pair of NumPy arrays for scalar fields if NumPy is
+        available, otherwise a pair of lists. Packets too short to contain
+        the field are skipped.
+        """
+
+        projection = self.tfac.make_projection(self.spec, [field])
+        unpack_from, offset, scalar = projection.unpackers[0]
+        f_format = projection.formats[0]
+
+        if projection.size > self.slot_size:
+            raise ValueError("Field {} lies outside of the history slots of size {}".format(
+                field, self.slot_size))
+
+        with self.lock:
+            slots = self.get_slots(n)
+
+            if np is not None and scalar and f_format[1:] in NUMPY_FORMATS:
+                slots = np.array(slots, dtype=np.intp)
+                sizes = np.frombuffer(self.sizes, dtype=np.uint32)
+                slots = slots[sizes[slots] >= projection.size]
+
+                # Strided view of the field in every slot
+                values = np.ndarray(
+                        shape=(self.depth,),
+                        dtype=np.dtype(f_format[0] + NUMPY_FORMATS[f_format[1:]]),
+                        buffer=self.arena,
+                        offset=offset,
+                        strides=(self.slot_size,))
+
+                return (np.frombuffer(self.stamps, dtype=np.float64)[slots],
+                        values[slots])
+
+            slots = [slot for slot in slots if self.sizes[slot] >= projection.size]
+            start = [slot * self.slot_size for slot in slots]
+
+            return ([self.stamps[slot] for slot in slots],
+                    [unpack_from(self.arena, s + offset)[0] if scalar else unpack_from(self.arena, s + offset)
+                        for s in start])
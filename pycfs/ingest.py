@@ -0,0 +1,157 @@
+from __future__ import print_function
+
+import threading
+import multiprocessing
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from .listener import UDPListener
+
+class MultiProcessListener(object):
+    """
+    telemetry listener which decodes messages in several worker processes
+
+    Each worker process runs its own UDPListener bound to the same port with
+    SO_REUSEPORT, so the kernel distributes incoming messages between the
+    workers by sender. Messages from any single cFS instance are always
+    handled by the same worker, while several instances streaming at once
+    are decoded in parallel.
+
+    Callbacks run in the worker processes. Any value returned by a callback
+    is sent back to this process over a single queue and passed to the
+    aggregation callbacks, with signature:
+        cb(mid, result)
+
+    All subscriptions must be made before calling start().
+    """
+    def __init__(self, host, port, type_specs, n_workers=None, max_size=8192,
+            endianness='little', reassembler=None):
+        """
+        n_workers: number of worker processes (default: number of cpus)
+        reassembler: optional SegmentReassembler, each worker gets its own
+            copy
+        """
+
+        self.host = host
+        self.port = port
+        self.type_specs = type_specs
+        self.max_size = max_size
+        self.endianness = endianness
+        self.reassembler = reassembler
+
+        if n_workers is None:
+            n_workers = multiprocessing.cpu_count()
+        self.n_workers = n_workers
+
+        # Workers inherit the callbacks, so they must be forked
+        if hasattr(multiprocessing, 'get_context'):
+            self.mp = multiprocessing.get_context('fork')
+        else:
+            self.mp = multiprocessing
+
+        self.subscriptions = []
+        self.aggregate_cbs = []
+
+        self.results = self.mp.Queue()
+        self.stop_event = self.mp.Event()
+        self.workers = []
+
+        self.running = True
+        self.thread = threading.Thread(target=self.aggregator_thread)
+
+    def start(self):
+        for i in range(self.n_workers):
+            worker = self.mp.Process(target=self.worker_process, args=(i,))
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+        self.thread.start()
+
+    def shutdown(self):
+        print('Shutting down MultiProcessListener...')
+        self.stop_event.set()
+        for worker in self.workers:
+            worker.join()
+        self.running = False
+        self.thread.join()
+
+    def worker_process(self, index):
+
+        listener = UDPListener(self.host, self.port, self.type_specs,
+                max_size=self.max_size,
+                endianness=self.endianness,
+                reassembler=self.reassembler,
+                reuse_port=True)
+
+        for mid, spec, cbs, fields, as_dict, decoder in self.subscriptions:
+            listener.listen(mid, spec,
+                    [self.forward(mid, cb) for cb in cbs],
+                    fields=fields, as_dict=as_dict, decoder=decoder)
+
+        listener.start()
+        try:
+            self.stop_event.wait()
+        except KeyboardInterrupt:
+            pass
+        listener.shutdown()
+
+        # Don't block exit on results which will never be aggregated
+        self.results.cancel_join_thread()
+
+    def forward(self, mid, cb):
+        """wrap a callback to send its result to the aggregation queue"""
+
+        def forwarding_cb(packet):
+            result = cb(packet)
+            if result is not None:
+                self.results.put((mid, result))
+
+        return forwarding_cb
+
+    def aggregator_thread(self):
+
+        while self.running:
+            try:
+                mid, result = self.results.get(timeout=1.0)
+            except queue.Empty:
+                continue
+
+            for cb in self.aggregate_cbs:
+                try:
+                    cb(mid, result)
+                except Exception as ex:
+                    print('ERROR: Exception in aggregation callback for MID {}: {}'.format(mid, ex))
+
+        print('Aggregator thread terminated.')
+
+    def listen(self, mid, spec, cbs, fields=None, as_dict=False, decoder=None):
+        """
+        call callback(s) in the worker processes when receiving message with
+        message id mid
+
+        see UDPListener.listen
+        """
+
+        if len(self.workers) > 0:
+            raise Exception("Can't add subscriptions after workers have started.")
+
+        # support old use case of passing a single function as callback
+        if hasattr(cbs, '__call__'):
+            cbs = [cbs]
+
+        self.subscriptions.append((mid, spec, cbs, fields, as_dict, decoder))
+
+    def aggregate(self, cbs):
+        """
+        call callback(s) in this process with the results returned by the
+        worker callbacks
+        """
+
+        if hasattr(cbs, '__call__'):
+            cbs = [cbs]
+
+        self.aggregate_cbs.extend(cbs)
@@ -4,15 +4,32 @@ from __future__ import print_function
 from builtins import bytes
 
 import sys
+import time
 import threading
 import socket
 import struct
 import select
 
-from .serialization import TelemetryFactory
+from .serialization import clock, TelemetryFactory
+from .history import PacketHistory
 
 class UDPListener(object):
-    def __init__(self, host, port, type_specs, max_size=8192, endianness='litte'):
+
+    # Seconds between calls to the flush() method of decoders which have one
+    FLUSH_INTERVAL = 1.0
+
+    # Seconds between expiring the reassembler's incomplete packets
+    EXPIRE_INTERVAL = 1.0
+
+    def __init__(self, host, port, type_specs, max_size=8192, endianness='little',
+            reassembler=None, reuse_port=False, history_memory=64*1024*1024):
+        """
+        reassembler: optional SegmentReassembler used to rebuild segmented
+            packets before they are decoded
+        reuse_port: set SO_REUSEPORT so that several listeners can share the
+            port, with the kernel distributing messages between them
+        history_memory: maximum number of bytes used by all packet histories
+        """
         self.cb_dict = {}
 
         self.host = host
@@ -22,9 +39,21 @@ class UDPListener(object):
 
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.socket.settimeout(1.0)
+        if reuse_port:
+            if not hasattr(socket, 'SO_REUSEPORT'):
+                raise Exception("SO_REUSEPORT is not supported on this platform.")
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         self.socket.bind((host,port))
 
         self.tfac = TelemetryFactory(type_specs, endianness)
+        self.reassembler = reassembler
+
+        # Optional RulesEngine evaluated for each message
+        self.rules = None
+
+        # Packet histories by MID
+        self.histories = {}
+        self.history_memory = history_memory
 
         self.running = True
         self.thread = threading.Thread(target=self.listener_thread)
@@ -42,20 +71,44 @@ class UDPListener(object):
 
         print('Starting listener thread...')
 
+        last_flush = clock()
+        last_expire = clock()
+
         while self.running:
+            if clock() - last_flush >= self.FLUSH_INTERVAL:
+                self.flush_decoders()
+                last_flush = clock()
+
+            # Expire on an interval rather than only when idle, so that a
+            # steady stream of other messages can't hold buffers forever
+            if self.reassembler is not None and clock() - last_expire >= self.EXPIRE_INTERVAL:
+                self.reassembler.expire()
+                last_expire = clock()
+
             readable, writable, exceptional = select.select([self.socket],[],[self.socket], 1.0)
             if not readable:
                 continue
 
             #print('Receiving...')
             data, sender_addr = self.socket.recvfrom(self.MAX_MSG_SIZE)
+            t_recv = clock()
 
             if len(data) == self.MAX_MSG_SIZE:
                 raise Exception("Socket received {} bytes, full message not received.".format(self.MAX_MSG_SIZE))
 
+            if self.reassembler is not None:
+                try:
+                    data = self.reassembler.push(data)
+                except ValueError as err:
+                    print('ERROR: Could not reassemble packet: {}'.format(err))
+                    continue
+
+                if data is None:
+                    continue
+
             try:
                 apid, seq, data_len, stamp  = self.tfac.unpack_header(data)
-            except ValueError as err:
+            except (ValueError, struct.error) as err:
                 print('ERROR: Could not unpack packet header: {}'.format(err))
                 continue
 
@@ -63,8 +116,29 @@ class UDPListener(object):
 
             mid = apid
 
-            for spec,cbs in self.cb_dict.get(mid,[]):
-                cstruct = self.tfac.unpack_payload(data,spec)
+            if self.rules is not None:
+                try:
+                    self.rules.process(mid, data, t_recv)
+                except Exception as ex:
+                    print('ERROR: Exception in rules for MID {}: {}'.format(mid, ex))
+
+            history = self.histories.get(mid, None)
+            if history is not None:
+                history.append(data, time.time())
+
+            for spec,cbs,decoder in self.cb_dict.get(mid,[]):
+                if decoder is None:
+                    cstruct = self.tfac.unpack_payload(data,spec)
+                else:
+                    try:
+                        cstruct = decoder.unpack(data)
+                    except ValueError as err:
+                        print('ERROR: Could not unpack fields for MID {}: {}'.format(mid, err))
+                        continue
+
+                    # Nothing to report for this message
+                    if cstruct is None:
+                        continue
                 try:
                     for cb in cbs:
                         cb(cstruct)
@@ -73,12 +147,40 @@ class UDPListener(object):
 
         print('Listener thread terminated.')
 
+    def flush_decoders(self):
+        """
+        deliver the messages held back by decoders (e.g. the end of an
+        event storm), by calling the callbacks with each value returned by
+        their flush() method
+        """
+
+        for mid, subscriptions in list(self.cb_dict.items()):
+            for spec,cbs,decoder in subscriptions:
+                if not hasattr(decoder, 'flush'):
+                    continue
 
-    def listen(self, mid, spec, cbs):
+                try:
+                    for cstruct in decoder.flush():
+                        for cb in cbs:
+                            cb(cstruct)
+                except Exception as ex:
+                    print('ERROR: Exception in callback for MID {}: {}'.format(mid, ex))
+
+    def listen(self, mid, spec, cbs, fields=None, as_dict=False, decoder=None):
         """
         call callback(s) when receiving message with message id mid
         cbs is a list of callbacks, each with signature:
             cb(stamp, packet)
+
+        if fields is given, only those fields of spec are decoded, and the
+        callbacks receive a tuple of their values (or a dict keyed by field
+        if as_dict is set) instead of a CStruct
+
+        if decoder is given, its unpack(data) method is used to decode
+        messages instead, and the callbacks aren't called when it returns
+        None (e.g. an EventDecoder). If the decoder has a flush() method, it
+        is called every FLUSH_INTERVAL seconds and the callbacks are called
+        with each value it returns.
         """
 
         print('Listening to MID 0x%x' % mid)
@@ -90,6 +192,37 @@ class UDPListener(object):
         if hasattr(cbs, '__call__'):
             cbs = [cbs]
 
-        self.cb_dict[mid].append((spec,cbs))
+        if decoder is None and fields is not None:
+            decoder = self.tfac.make_projection(spec, fields, as_dict=as_dict)
+
+        self.cb_dict[mid].append((spec,cbs,decoder))
+
+    def record(self, mid, spec, depth=1000, slot_size=None):
+        """
+        keep the last depth packets with message id mid
+
+        slot_size is the maximum size of a stored packet, which defaults to
+        the size of a message with payload spec
+
+        returns the PacketHistory, which is also available from history(mid)
+        """
+
+        if slot_size is None:
+            slot_size = self.tfac.make_projection(spec, []).size
+
+        history = PacketHistory(self.tfac, spec, depth, slot_size)
+
+        used = sum(h.nbytes for m,h in self.histories.items() if m != mid)
+        if used + history.nbytes > self.history_memory:
+            raise ValueError("History for MID 0x{:x} needs {} bytes, only {} of {} available".format(
+                mid, history.nbytes, self.history_memory - used, self.history_memory))
+
+        print('Recording last {} messages of MID 0x{:x}'.format(depth, mid))
+
+        self.histories[mid] = history
 
+        return history
 
+    def history(self, mid):
+        """get the PacketHistory of a recorded MID"""
+        return self.histories[mid]
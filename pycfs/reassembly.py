@@ -0,0 +1,175 @@
+from __future__ import print_function
+
+import time
+import struct
+
+from .serialization import CCSDS
+
+class SegmentReassembler(object):
+    """
+    reassembles segmented CCSDS packets into contiguous buffers
+
+    Segments are accumulated per APID into buffers drawn from a fixed pool
+    which is allocated up front, so the memory used for reassembly is bounded
+    by `max_memory` regardless of the number or size of segmented packets in
+    flight. Each segment is copied exactly once into its final position in
+    the buffer.
+
+    The reassembled packet consists of the primary header of the first
+    segment (with its sequence flags set to unsegmented and its data length
+    updated) followed by the data fields of every segment in order. Since the
+    first segment carries the secondary header, the result can be decoded
+    like any other telemetry packet.
+    """
+
+    # Largest packet whose data length fits in the primary header
+    MAX_PACKET_SIZE = CCSDS.PRI.SIZE + CCSDS.PRI.MASK_PAYLOAD_SIZE + 1
+
+    def __init__(self, max_packet_size=65536, max_memory=4*1024*1024,
+            timeout=5.0):
+        """
+        max_packet_size: maximum size of a reassembled packet in bytes, at
+            most MAX_PACKET_SIZE which the primary header can describe
+        max_memory: maximum number of bytes used for reassembly buffers
+        timeout: seconds after the last segment before a partial packet is
+            discarded
+        """
+
+        if max_packet_size > self.MAX_PACKET_SIZE:
+            raise ValueError("Maximum packet size {} exceeds the largest CCSDS packet size {}".format(
+                max_packet_size, self.MAX_PACKET_SIZE))
+
+        if max_packet_size > max_memory:
+            raise ValueError("Maximum packet size {} exceeds memory cap {}".format(
+                max_packet_size, max_memory))
+
+        self.max_packet_size = max_packet_size
+        self.max_memory = max_memory
+        self.timeout = timeout
+
+        self.pri_struct = struct.Struct(CCSDS.PRI.FORMAT)
+
+        # Preallocated buffer pool
+        n_buffers = max_memory // max_packet_size
+        self._free = [bytearray(max_packet_size) for i in range(n_buffers)]
+
+        # Partial packets by APID: [buffer, size, next sequence count, deadline]
+        self._pending = {}
+
+        # Buffer delivered by the last call to push()
+        self._delivered = None
+
+    def _release(self, buf):
+        self._free.append(buf)
+
+    def _acquire(self):
+        """get a free buffer, evicting the oldest partial packet if needed"""
+
+        if len(self._free) == 0:
+            apid = min(self._pending, key=lambda k: self._pending[k][3])
+            print('WARNING: Reassembly memory exhausted, dropping partial packet for APID 0x{:03x}'.format(apid))
+            self._release(self._pending.pop(apid)[0])
+
+        return self._free.pop()
+
+    def _drop(self, apid, reason):
+        print('WARNING: Dropping partial packet for APID 0x{:03x}: {}'.format(apid, reason))
+        self._release(self._pending.pop(apid)[0])
+
+    def expire(self, now=None):
+        """discard partial packets which have not been updated in time"""
+
+        if now is None:
+            now = time.time()
+
+        for apid in [k for k,v in self._pending.items() if v[3] < now]:
+            self._drop(apid, 'timed out')
+
+    def push(self, data, now=None):
+        """
+        add a packet or segment
+
+        Unsegmented packets are returned unchanged. When the last segment of
+        a packet is received, a memoryview of the reassembled packet is
+        returned. Otherwise this returns None.
+
+        The returned view references an internal buffer and is only valid
+        until the next call to push().
+
+        Raises ValueError if data is too short for a primary header.
+        """
+
+        if self._delivered is not None:
+            self._release(self._delivered)
+            self._delivered = None
+
+        if now is None:
+            now = time.time()
+
+        if len(data) < CCSDS.PRI.SIZE:
+            raise ValueError("Packet of size {} too short for primary header".format(len(data)))
+
+        pri_id, pri_seq, pri_data_len = self.pri_struct.unpack_from(data, 0)
+
+        flags = pri_seq & CCSDS.PRI.MASK_SEQUENCE_FLAGS
+        if flags == CCSDS.PRI.SEQUENCE_UNSEGMENTED:
+            return data
+
+        apid = pri_id & CCSDS.PRI.MASK_APID
+        count = pri_seq & CCSDS.PRI.MASK_SEQUENCE_NUMBER
+
+        # Data length field is the data field size -1
+        # (ref: CCSDS 133.0-B-2 Section 4.1.3.5.3)
+        segment_end = min(len(data), CCSDS.PRI.SIZE + pri_data_len + 1)
+
+        if flags == CCSDS.PRI.SEQUENCE_FIRST:
+            if apid in self._pending:
+                self._drop(apid, 'new first segment received')
+
+            pending = [self._acquire(), 0, count, 0]
+            self._pending[apid] = pending
+
+            # Keep the primary header of the first segment
+            segment_start = 0
+        else:
+            pending = self._pending.get(apid, None)
+            if pending is None:
+                # Missed the first segment
+                return None
+
+            if count != pending[2]:
+                self._drop(apid, 'expected sequence count {} but got {}'.format(
+                    pending[2], count))
+                return None
+
+            segment_start = CCSDS.PRI.SIZE
+
+        buf, size = pending[0], pending[1]
+        segment_size = segment_end - segment_start
+
+        if size + segment_size > self.max_packet_size:
+            self._drop(apid, 'exceeds maximum packet size {}'.format(
+                self.max_packet_size))
+            return None
+
+        buf[size:size + segment_size] = memoryview(data)[segment_start:segment_end]
+
+        pending[1] = size + segment_size
+        pending[2] = (count + 1) & CCSDS.PRI.MASK_SEQUENCE_NUMBER
+        pending[3] = now + self.timeout
+
+        if flags != CCSDS.PRI.SEQUENCE_LAST:
+            return None
+
+        # Complete, rewrite the primary header to describe the whole packet
+        del self._pending[apid]
+        size = pending[1]
+
+        self.pri_struct.pack_into(buf, 0,
+                self.pri_struct.unpack_from(buf, 0)[0],
+                CCSDS.PRI.SEQUENCE_UNSEGMENTED | count,
+                size - CCSDS.PRI.SIZE - 1)
+
+        self._delivered = buf
+
+        return memoryview(buf)[0:size]
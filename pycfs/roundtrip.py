@@ -0,0 +1,239 @@
+from __future__ import print_function
+
+import time
+import threading
+
+from .serialization import clock
+
+class RoundTripResult(object):
+    """latency and acceptance results of a paced command stream"""
+    def __init__(self, rate, n_sent, n_accepted, latencies, duration,
+            n_unexpected=0):
+        """
+        n_unexpected: counter increments which couldn't be matched to a
+            command of the run
+        """
+        self.rate = rate
+        self.n_sent = n_sent
+        self.n_accepted = n_accepted
+        self.latencies = sorted(latencies)
+        self.duration = duration
+        self.n_unexpected = n_unexpected
+
+    @property
+    def acceptance(self):
+        return float(self.n_accepted) / self.n_sent if self.n_sent > 0 else 0.0
+
+    @property
+    def achieved_rate(self):
+        return self.n_sent / self.duration if self.duration > 0 else 0.0
+
+    def percentile(self, p):
+        """get the p-th percentile latency in seconds"""
+        if len(self.latencies) == 0:
+            return None
+        index = min(len(self.latencies) - 1, int(p / 100.0 * len(self.latencies)))
+        return self.latencies[index]
+
+    def summary(self):
+        if len(self.latencies) == 0:
+            latency = 'no commands accepted'
+        else:
+            latency = 'latency ms min/p50/p90/p99/max: {:.1f}/{:.1f}/{:.1f}/{:.1f}/{:.1f}'.format(
+                    *[1e3 * t for t in (
+                        self.latencies[0],
+                        self.percentile(50),
+                        self.percentile(90),
+                        self.percentile(99),
+                        self.latencies[-1])])
+
+        unexpected = ' unexpected: {}'.format(self.n_unexpected) if self.n_unexpected else ''
+
+        return 'rate: {:.1f}/s (achieved {:.1f}/s) accepted: {}/{} ({:.1%}) {}{}'.format(
+                self.rate, self.achieved_rate,
+                self.n_accepted, self.n_sent, self.acceptance,
+                latency, unexpected)
+
+class CommandRoundTrip(object):
+    """
+    measures command round trips by watching an app's housekeeping command
+    counter
+
+    Commands are sent at a fixed rate through a UDPCommander, and the
+    latency of each command is the time until the command counter reported
+    in housekeeping accounts for it. Latencies can therefore only be
+    resolved to the housekeeping period, and the counter must not wrap
+    between two housekeeping messages, which is warned about when
+    2**counter_bits or more commands are sent between them.
+
+    Increments are matched to the commands in the order they were sent, so
+    nothing else may command the app during a run. Increments which come
+    before the next unmatched command was sent are counted as unexpected
+    and left out, but an extra or dropped command otherwise shifts the
+    latencies of all the commands after it.
+
+    Works against a cFS target or a Simulator.
+    """
+    def __init__(self, commander, listener, hk_mid, hk_spec,
+            counter_field='CommandCounter', counter_bits=8):
+        """
+        commander: UDPCommander used to send the commands
+        listener: UDPListener receiving the housekeeping messages
+        hk_mid: message id of the housekeeping messages
+        hk_spec: struct specification of the housekeeping payload
+        counter_field: field of the accepted command counter
+        counter_bits: width of the command counter
+        """
+
+        self.commander = commander
+        self.counter_modulus = 1 << counter_bits
+
+        # Unwrapped number of accepted commands and when each was seen
+        self.lock = threading.Condition()
+        self.last_counter = None
+        self.n_accepted = 0
+        self.accept_times = []
+
+        # Number of commands sent by run, and at the last housekeeping
+        self.n_sent = 0
+        self.last_sent = 0
+
+        listener.listen(hk_mid, hk_spec, self.on_housekeeping, fields=[counter_field])
+
+    def on_housekeeping(self, values):
+        t_recv = clock()
+        counter = values[0]
+
+        with self.lock:
+            if self.last_counter is not None:
+                # With as many commands as the modulus, the increment
+                # can't be told apart from a wrap
+                n_sent = self.n_sent - self.last_sent
+                if n_sent >= self.counter_modulus:
+                    print('WARNING: {} commands sent between housekeeping messages, '
+                          'the {} bit command counter may have wrapped'.format(
+                              n_sent, self.counter_modulus.bit_length() - 1))
+
+                n_new = (counter - self.last_counter) % self.counter_modulus
+                self.accept_times.extend([t_recv] * n_new)
+                self.n_accepted += n_new
+
+            self.last_counter = counter
+            self.last_sent = self.n_sent
+            self.lock.notify_all()
+
+    def wait_for_housekeeping(self, timeout=10.0):
+        """wait until the command counter is known"""
+
+        deadline = clock() + timeout
+        with self.lock:
+            while self.last_counter is None:
+                remaining = deadline - clock()
+                if remaining <= 0:
+                    raise Exception("No housekeeping received in {} seconds.".format(timeout))
+                self.lock.wait(remaining)
+
+    def run(self, cmd_bytes, rate, n_commands, settle=3.0):
+        """
+        send n_commands copies of cmd_bytes at rate commands per second and
+        wait up to settle seconds for them to be accepted
+
+        returns a RoundTripResult
+        """
+
+        self.wait_for_housekeeping()
+
+        with self.lock:
+            start_accepted = self.n_accepted
+
+        period = 1.0 / rate
+        send_times = []
+
+        start = clock()
+        for i in range(n_commands):
+            deadline = start + i * period
+            while True:
+                remaining = deadline - clock()
+                if remaining <= 0:
+                    break
+                time.sleep(remaining)
+
+            send_times.append(clock())
+            self.commander.send(cmd_bytes)
+            with self.lock:
+                self.n_sent += 1
+
+        duration = send_times[-1] - start if n_commands > 1 else 0.0
+        duration += period
+
+        # Wait for the counter to settle
+        deadline = clock() + settle
+        with self.lock:
+            while True:
+                latencies, n_unexpected = self.match(send_times,
+                        self.accept_times[start_accepted:self.n_accepted])
+                if len(latencies) >= n_commands:
+                    break
+
+                remaining = deadline - clock()
+                if remaining <= 0:
+                    break
+                self.lock.wait(remaining)
+
+        if n_unexpected > 0:
+            print('WARNING: {} command counter increments not matched to the commands sent'.format(
+                n_unexpected))
+
+        return RoundTripResult(rate, n_commands, len(latencies), latencies, duration,
+                n_unexpected=n_unexpected)
+
+    @staticmethod
+    def match(send_times, accept_times):
+        """
+        match counter increments to the commands sent
+
+        Commands are accepted in the order they are sent, so increments
+        seen before the next command was sent (e.g. from other commands) or
+        after all of them were accepted are unexpected.
+
+        returns (latencies, number of unexpected increments)
+        """
+
+        latencies = []
+        n_unexpected = 0
+        for t_accept in accept_times:
+            i = len(latencies)
+            if i < len(send_times) and t_accept >= send_times[i]:
+                latencies.append(t_accept - send_times[i])
+            else:
+                n_unexpected += 1
+
+        return latencies, n_unexpected
+
+    def sweep(self, cmd_bytes, rates, n_commands, min_acceptance=0.99,
+            settle=3.0, verbose=True):
+        """
+        run at each of the given rates in increasing order, stopping at the
+        first rate at which less than min_acceptance of commands were
+        accepted
+
+        returns (results, highest rate below the first failing rate, or
+        None if the lowest rate failed)
+        """
+
+        results = []
+        max_rate = None
+
+        for rate in sorted(rates):
+            result = self.run(cmd_bytes, rate, n_commands, settle=settle)
+            results.append(result)
+
+            if verbose:
+                print(result.summary())
+
+            if result.acceptance < min_acceptance:
+                break
+
+            max_rate = rate
+
+        return results, max_rate
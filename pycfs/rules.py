@@ -0,0 +1,174 @@
+from __future__ import print_function
+
+import struct
+import operator
+import collections
+
+from .serialization import clock, CommandFactory, TelemetryFactory
+
+class Rule(object):
+    """
+    a condition on a telemetry field which triggers a command
+
+    The condition is compiled into a single unpack of the field at its
+    precomputed offset in the message, and the command is packed once when
+    the rule is created, so firing a rule only sends the prebuilt bytes.
+    """
+
+    OPERATORS = {
+            '>':  operator.gt,
+            '>=': operator.ge,
+            '<':  operator.lt,
+            '<=': operator.le,
+            '==': operator.eq,
+            '!=': operator.ne,
+            }
+
+    def __init__(self, name, projection, op, threshold, command,
+            edge=True, holdoff=0.0, max_latencies=1000):
+        """
+        name: name of the rule for reporting
+        projection: Projection of the single scalar field to check
+        op: comparison operator, one of: > >= < <= == !=
+        threshold: value the field is compared against
+        command: packed command bytes to send when the rule fires
+        edge: only fire when the condition becomes true, instead of for
+            every message for which it is true
+        holdoff: minimum time in seconds between firings
+        max_latencies: number of firing latencies to keep
+        """
+
+        if op not in self.OPERATORS:
+            raise ValueError("Unknown operator {}, must be one of: {}".format(
+                op, ', '.join(sorted(self.OPERATORS))))
+
+        if len(projection.unpackers) != 1 or not projection.unpackers[0][2]:
+            raise ValueError("Rules must check a single scalar field: {}".format(
+                projection.fields))
+
+        self.name = name
+        self.field = projection.fields[0]
+        self.op = op
+        self.threshold = threshold
+        self.command = command
+        self.edge = edge
+        self.holdoff = holdoff
+
+        unpack_from, offset, _ = projection.unpackers[0]
+        compare = self.OPERATORS[op]
+        self.predicate = lambda data: compare(unpack_from(data, offset)[0], threshold)
+
+        self.active = False
+        self.last_fired = None
+        self.n_fired = 0
+
+        # Telemetry receipt to command sent latencies in seconds
+        self.latencies = collections.deque(maxlen=max_latencies)
+
+    def check(self, data, t_recv):
+        """check if the rule should fire for a message received at t_recv"""
+
+        if not self.predicate(data):
+            self.active = False
+            return False
+
+        # Already fired for this edge
+        if self.edge and self.active:
+            return False
+
+        # Don't consume the edge during the holdoff, so the rule still fires
+        # once it has elapsed if the condition remains true
+        if self.last_fired is not None and t_recv - self.last_fired < self.holdoff:
+            return False
+
+        self.active = True
+
+        return True
+
+    def get_latency_stats(self):
+        """get the (min, mean, max) firing latency in seconds"""
+        if len(self.latencies) == 0:
+            return None
+        return (min(self.latencies),
+                sum(self.latencies) / len(self.latencies),
+                max(self.latencies))
+
+class RulesEngine(object):
+    """
+    sends commands in reaction to telemetry
+
+    The rules are evaluated by a UDPListener as each message is received,
+    before any callbacks are run:
+        lsnr.rules = RulesEngine(cmdr, MSG)
+    """
+    def __init__(self, commander, type_specs, endianness='little'):
+        """
+        commander: UDPCommander used to send the commands
+        """
+        self.commander = commander
+        self.tfac = TelemetryFactory(type_specs, endianness)
+        self.cfac = CommandFactory(type_specs, endianness)
+
+        self.rules = {}
+
+    def add_rule(self, mid, spec, field, op, threshold, cmd_mid, cc,
+            cstruct=None, name=None, edge=True, holdoff=0.0):
+        """
+        send command (cmd_mid, cc, cstruct) when field of message mid
+        compares to threshold with op, e.g.:
+            engine.add_rule(MID.X_HK_TLM_MID, MSG.X_HkTlm_Payload_t,
+                'Temp', '>', 80.0,
+                MID.X_CMD_MID, CC.X_SAFE_CC)
+
+        returns the Rule
+        """
+
+        if name is None:
+            name = '{} {} {}'.format(field, op, threshold)
+
+        rule = Rule(name,
+                self.tfac.make_projection(spec, [field]),
+                op,
+                threshold,
+                self.cfac.pack(cmd_mid, cc, cstruct),
+                edge=edge,
+                holdoff=holdoff)
+
+        self.rules.setdefault(mid, []).append(rule)
+
+        return rule
+
+    def remove_rule(self, rule):
+        for mid, rules in self.rules.items():
+            if rule in rules:
+                rules.remove(rule)
+
+    def process(self, mid, data, t_recv):
+        """evaluate the rules for a message received at t_recv"""
+
+        for rule in self.rules.get(mid, ()):
+            try:
+                fire = rule.check(data, t_recv)
+            except struct.error as err:
+                print('ERROR: Could not check rule "{}" for MID {}: {}'.format(rule.name, mid, err))
+                continue
+
+            if fire:
+                self.commander.send(rule.command)
+                t_sent = clock()
+                rule.latencies.append(t_sent - t_recv)
+                rule.last_fired = t_recv
+                rule.n_fired += 1
+
+    def report(self):
+        """print the firing count and latencies of each rule"""
+
+        for mid in sorted(self.rules):
+            for rule in self.rules[mid]:
+                stats = rule.get_latency_stats()
+                if stats is None:
+                    print('MID 0x{:04x} "{}": fired 0 times'.format(mid, rule.name))
+                else:
+                    print('MID 0x{:04x} "{}": fired {} times, latency min/mean/max: {:.1f}/{:.1f}/{:.1f} us'.format(
+                        mid, rule.name, rule.n_fired,
+                        *[1e6 * t for t in stats]))
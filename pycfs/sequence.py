@@ -0,0 +1,225 @@
+from __future__ import print_function
+
+import re
+import ast
+import time
+import threading
+
+from .serialization import clock, CStruct
+
+class CommandSequence(object):
+    """
+    a sequence of commands packed ahead of time, each with a time offset in
+    seconds from the start of the sequence
+
+    Sequence files have one command per line:
+        DELAY MID CC [STRUCT [FIELD=VALUE ...]]
+
+    where DELAY is the time in seconds since the previous command, MID, CC
+    and STRUCT are names from the bundle (or numbers for MID and CC), and
+    VALUE is a Python literal without spaces outside of quotes. Quoted
+    values are always strings, and unquoted values which aren't literals
+    are taken as strings. Fields of nested structs are named by their
+    dotted path. Everything after a '#' outside of quotes is a comment. For
+    example:
+
+        # Enable telemetry output
+        0.0  TO_LAB_CMD_MID  TO_OUTPUT_ENABLE_CC  TO_LAB_EnableOutput_Payload_t  dest_IP='10.0.0.1'
+        0.5  SAMPLE_APP_CMD_MID  SAMPLE_APP_NOOP_CC
+    """
+
+    # Runs of unquoted characters and quoted strings, a comment, or an
+    # unterminated quote
+    TOKEN_RE = re.compile(r'''(?:[^\s'"#]|'(?:\\.|[^'\\])*'|"(?:\\.|[^"\\])*")+|#.*|\S''')
+
+    def __init__(self, commands=None):
+        """
+        commands: list of (time offset, command bytes)
+        """
+        self.commands = list(commands) if commands is not None else []
+
+    def __len__(self):
+        return len(self.commands)
+
+    @classmethod
+    def load(cls, path, cfac, mid_db, cc_db, msg_db):
+        """parse, validate and pack a sequence file"""
+        with open(path, 'r') as sequence_file:
+            return cls.parse(sequence_file, cfac, mid_db, cc_db, msg_db, path)
+
+    @classmethod
+    def parse(cls, lines, cfac, mid_db, cc_db, msg_db, name='<sequence>'):
+        """parse, validate and pack the lines of a sequence"""
+
+        commands = []
+        t = 0.0
+
+        for line_number, line in enumerate(lines, 1):
+            try:
+                tokens = cls.split(line)
+                if len(tokens) == 0:
+                    continue
+
+                if len(tokens) < 3:
+                    raise ValueError("Expected at least DELAY MID CC")
+
+                delay = float(tokens[0])
+                if delay < 0:
+                    raise ValueError("Negative delay: {}".format(delay))
+
+                mid = cls.lookup(mid_db, tokens[1])
+                cc = cls.lookup(cc_db, tokens[2])
+
+                if len(tokens) > 3:
+                    spec = getattr(msg_db, tokens[3])
+                    cstruct = cls.make_cstruct(cfac.formatter, spec,
+                            [cls.parse_assignment(a) for a in tokens[4:]])
+                else:
+                    cstruct = None
+
+                cmd_bytes = cfac.pack(mid, cc, cstruct)
+            except Exception as ex:
+                raise ValueError("{}:{}: {}".format(name, line_number, ex))
+
+            t += delay
+            commands.append((t, cmd_bytes))
+
+        return cls(commands)
+
+    @classmethod
+    def split(cls, line):
+        """
+        split a line into whitespace separated tokens, keeping the quotes of
+        quoted strings so that they are parsed as strings
+        """
+
+        tokens = []
+        for match in cls.TOKEN_RE.finditer(line):
+            token = match.group(0)
+            if token.startswith('#'):
+                break
+            if token in ('"', "'"):
+                raise ValueError("Unterminated quote: {}".format(line[match.start():].strip()))
+            tokens.append(token)
+
+        return tokens
+
+    @staticmethod
+    def lookup(db, token):
+        """get a value by name from a database, or as a number"""
+        if token in db._fw:
+            return db._fw[token]
+        try:
+            return int(token, 0)
+        except ValueError:
+            raise ValueError("Unknown name: {}".format(token))
+
+    @staticmethod
+    def parse_assignment(token):
+        """parse FIELD=VALUE into a (path, value) pair"""
+        if '=' not in token:
+            raise ValueError("Expected FIELD=VALUE: {}".format(token))
+
+        field, value = token.split('=', 1)
+        try:
+            value = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            # Unquoted strings
+            pass
+
+        return field.split('.'), value
+
+    @classmethod
+    def make_cstruct(cls, formatter, spec, assignments):
+        """build a CStruct from a list of (path, value) assignments"""
+
+        members = {}
+        nested = {}
+
+        for path, value in assignments:
+            if len(path) == 1:
+                members[path[0]] = value
+            else:
+                nested.setdefault(path[0], []).append((path[1:], value))
+
+        m_types = {m_name: m_type for m_name, m_type, _ in spec.members}
+
+        for m_name, m_assignments in nested.items():
+            if m_name not in m_types:
+                raise ValueError("Inappropriate field for struct {}: {}".format(spec, m_name))
+
+            m_format, m_spec, m_count = formatter.resolve_member(m_types[m_name])
+            if m_spec is None or m_count != 1:
+                raise ValueError("Field {} is not a struct".format(m_name))
+
+            members[m_name] = cls.make_cstruct(formatter, m_spec, m_assignments)
+
+        return CStruct(spec, **members)
+
+class SequenceRunner(object):
+    """
+    sends a CommandSequence from a dedicated thread
+
+    Each command is sent at its time offset from the start of the sequence
+    by sleeping until shortly before it is due and then spinning, so timing
+    isn't limited by the resolution of sleep. The lateness of every command
+    is recorded.
+    """
+
+    # Seconds before a command is due to stop sleeping and start spinning
+    SPIN_TIME = 0.002
+
+    def __init__(self, commander, sequence):
+        self.commander = commander
+        self.sequence = sequence
+
+        # Seconds each command was sent after it was due
+        self.lateness = []
+
+        self.running = True
+        self.thread = threading.Thread(target=self.sender_thread)
+
+    def start(self):
+        self.thread.start()
+
+    def join(self):
+        self.thread.join()
+
+    def shutdown(self):
+        self.running = False
+        self.thread.join()
+
+    def sender_thread(self):
+
+        send = self.commander.send
+        lateness = self.lateness
+
+        start = clock()
+
+        for t, cmd_bytes in self.sequence.commands:
+            deadline = start + t
+
+            remaining = deadline - clock()
+            while remaining > self.SPIN_TIME and self.running:
+                time.sleep(min(remaining - self.SPIN_TIME, 0.1))
+                remaining = deadline - clock()
+
+            if not self.running:
+                break
+
+            while clock() < deadline:
+                pass
+
+            send(cmd_bytes)
+            lateness.append(clock() - deadline)
+
+    def summary(self):
+        if len(self.lateness) == 0:
+            return 'sent 0/{} commands'.format(len(self.sequence))
+
+        lateness = sorted(self.lateness)
+        return 'sent {}/{} commands, lateness us mean/p99/max: {:.1f}/{:.1f}/{:.1f}'.format(
+                len(lateness), len(self.sequence),
+                1e6 * sum(lateness) / len(lateness),
+                1e6 * lateness[min(len(lateness) - 1, int(0.99 * len(lateness)))],
+                1e6 * lateness[-1])
@@ -1,7 +1,29 @@
 
 from __future__ import print_function
 
+import time
 import struct
+import weakref
+import threading
+
+# High resolution clock for latency measurements
+clock = getattr(time, 'perf_counter', time.time)
+
+# NumPy type codes for each struct format char
+NUMPY_FORMATS = {
+        '?': '?',
+        'c': 'S1',
+        'b': 'i1',
+        'B': 'u1',
+        'h': 'i2',
+        'H': 'u2',
+        'i': 'i4',
+        'I': 'u4',
+        'q': 'i8',
+        'Q': 'u8',
+        'f': 'f4',
+        'd': 'f8',
+        }
 
 def get_padding(index, elem_size):
     return 'x' * ((elem_size - (index % elem_size)) % elem_size)
@@ -159,29 +181,133 @@ class Formatter(object):
                 'uint64':   ('Q', 8),
                 'uint64_t': ('Q', 8),
                 'float':    ('f', 4),
-                'double':   ('d', 8)
+                'double':   ('d', 8),
+                'signed char':              ('b', 1),
+                'unsigned char':            ('B', 1),
+                'short':                    ('h', 2),
+                'short int':                ('h', 2),
+                'unsigned short':           ('H', 2),
+                'unsigned short int':       ('H', 2),
+                'int':                      ('i', 4),
+                'signed int':               ('i', 4),
+                'unsigned':                 ('I', 4),
+                'unsigned int':             ('I', 4),
+                'long long':                ('q', 8),
+                'long long int':            ('q', 8),
+                'unsigned long long':       ('Q', 8),
+                'unsigned long long int':   ('Q', 8),
                 }
         self.alignment = {v[0]:v[1] for k,v in self.primitives.items()}
 
-        # resolve aliased primitive types
-        specs_to_process = list(self.specs._fw.items())
+        # Enumerations are stored as ints
+        self.enum_primitive = self.primitives['int']
 
-        last_invalid_spec = None
-        while len(specs_to_process) > 0:
-            spec_name, spec_value = specs_to_process.pop()
+        # Resolved types by name: (format char, struct spec, count)
+        self.types = {k: (v[0], None, 1) for k,v in self.primitives.items()}
 
-            if last_invalid_spec == spec_name:
-                break
+        # Cached layouts by (spec id, padding): (spec, layout)
+        self.layouts = {}
 
-            if type(spec_value) in [str,unicode]:
-                if spec_value in self.primitives:
-                    #print('spec {} is {}'.format(spec_name, spec_value))
-                    self.primitives[spec_name] = self.primitives[spec_value]
-                    last_invalid_spec = None
+        self.n_specs = 0
+        if self.specs is not None:
+            self.resolve_types()
+
+    def resolve_types(self):
+        """
+        resolve every type in the type specs to a primitive or a struct
+
+        Alias chains are followed once and every type along a chain is
+        resolved at the same time, so this is linear in the number of types.
+        Array typedefs multiply the count of the type they alias. Types
+        which can't be resolved are left out of the table.
+        """
+
+        unresolved = set()
+
+        for name in self.specs._fw.keys():
+            chain = []
+            type_name = name
+            resolved = None
+
+            while True:
+                if type_name in self.types:
+                    resolved = self.types[type_name]
+                    break
+
+                if type_name in unresolved or type_name in chain:
+                    break
+
+                # Enum tags are also in the specs, but only by name
+                if type_name.startswith('enum '):
+                    spec = None
+                elif type_name in self.specs._fw:
+                    spec = self.specs._fw[type_name]
+                else:
+                    break
+
+                chain.append(type_name)
+
+                if spec is None:
+                    resolved = (self.enum_primitive[0], None, 1)
+                    break
+                elif hasattr(spec, 'members'):
+                    resolved = (None, spec, 1)
+                    break
+                elif hasattr(spec, 'declarators'):
+                    # Array typedef, counted when the chain is assigned
+                    type_name = spec.type_spec
                 else:
-                    specs_to_process.insert(0,(spec_name, spec_value))
-                    if last_invalid_spec == None:
-                        last_invalid_spec = spec_name
+                    type_name = spec
+
+            if resolved is None:
+                unresolved.update(chain)
+                continue
+
+            # Assign the resolved type along the chain, innermost first
+            r_format, r_spec, r_count = resolved
+            for type_name in reversed(chain):
+                spec = self.specs._fw.get(type_name, None)
+                if hasattr(spec, 'declarators'):
+                    r_count *= self.get_multiplicity(spec)
+                self.types[type_name] = (r_format, r_spec, r_count)
+
+                if r_format is not None and r_count == 1:
+                    self.primitives[type_name] = (r_format, self.alignment[r_format])
+
+        self.n_specs = len(self.specs._fw)
+
+    def get_multiplicity(self, m_type):
+        """get the number of elements of a possibly multi-dimensional type"""
+
+        # Array dimensions are lists, function arguments are tuples
+        n = 1
+        for declarator in m_type.declarators:
+            if isinstance(declarator, list):
+                for dim in declarator:
+                    if dim is None:
+                        raise Exception("Can't determine size of type: {}".format(m_type))
+                    n *= dim
+        return n
+
+    def resolve_type(self, type_name):
+        """
+        get the (format char, struct spec, count) for a type name
+
+        exactly one of format char and struct spec is set
+        """
+        try:
+            return self.types[type_name]
+        except KeyError:
+            if type_name.startswith('enum '):
+                return (self.enum_primitive[0], None, 1)
+            raise Exception('Unknown type specifier: {}'.format(type_name))
+
+    def resolve_member(self, m_type):
+        """get the (format char, struct spec, count) for a struct member"""
+
+        m_format, m_spec, m_count = self.resolve_type(m_type.type_spec)
+
+        return m_format, m_spec, m_count * self.get_multiplicity(m_type)
 
     def make_cstruct(self, fields, spec):
         """
@@ -192,12 +318,9 @@ class Formatter(object):
 
         for m_name, m_type, _ in spec.members:
 
-            n_values = (
-                    m_type.declarators[0][0]
-                    if (len(m_type.declarators) > 0)
-                    else 1)
+            m_format, m_spec, n_values = self.resolve_member(m_type)
 
-            if m_type.type_spec in self.primitives:
+            if m_spec is None:
                 if n_values == 1:
                     val = fields[0]
                     fields = fields[1:]
@@ -206,15 +329,14 @@ class Formatter(object):
                     fields = fields[n_values:]
             else:
                 if n_values == 1:
-                    val,fields = self.make_cstruct(fields,
-                            self.specs._fw[m_type.type_spec])
+                    val,fields = self.make_cstruct(fields, m_spec)
                 else:
                     val = []
                     for i in range(n_values):
-                        sub_cstruct, fields = self.make_cstruct(fields,
-                                self.specs._fw[m_type.type_spec])
+                        sub_cstruct, fields = self.make_cstruct(fields, m_spec)
                         val.append(sub_cstruct)
 
+            cstruct.members[m_name] = val
             setattr(cstruct, m_name, val)
 
         return cstruct,fields
@@ -224,7 +346,11 @@ class Formatter(object):
         if self.specs is None:
             raise Exception('Unknown type specifier: {}'.format(type_name))
 
-        return getattr(self.specs, type_name)
+        m_format, m_spec, m_count = self.resolve_type(type_name)
+        if m_spec is None:
+            raise Exception('Not a struct type: {}'.format(type_name))
+
+        return m_spec
 
     def get_padded_format(self, format_str):
         size = struct.calcsize(format_str)
@@ -245,21 +371,38 @@ class Formatter(object):
         """get the struct.pack format specifier from a c struct specification
         """
 
+        return self.get_layout(spec, padding=padding)[0]
+
+    def get_layout(self, spec, padding=True):
+        """get the format specifier and the location of each primitive field
+
+        returns a (format_str, fields) pair where fields is a list of
+        (path, format_char, count, offset) tuples, one for each primitive
+        member of the struct or its sub-structs. Paths are dotted member
+        names, with indices for arrays of structs (e.g. 'Entry[2].Id')
+        and offsets are in bytes relative to the start of the struct.
+        """
+
+        key = (id(spec), padding)
+        if key in self.layouts:
+            return self.layouts[key][1]
+
         format_str = ''
-        format_size = 0
+        fields = []
 
         for m_name, m_type, _ in spec.members:
             # The packing format and size for this member
             m_padding = ''
             m_format_str = ''
+            m_fields = None
             m_index = struct.calcsize(format_str)
 
-            # Get the format string
-            if m_type.type_spec in self.primitives:
-                m_format_str = self.primitives[m_type.type_spec][0]
+            # Get the format string and the multiplicity of the member
+            m_format, m_spec, n = self.resolve_member(m_type)
+            if m_spec is None:
+                m_format_str = m_format
             else:
-                m_format_str = self.get_format(self.get_spec(m_type.type_spec),
-                        padding=padding)
+                m_format_str, m_fields = self.get_layout(m_spec, padding=padding)
 
             # Add padding
             if m_index > 0 and padding:
@@ -276,13 +419,17 @@ class Formatter(object):
                         m_index,
                         max_elem_alignment)
 
-            # Get the multiplicity of the member
-            if len(m_type.declarators) > 0:
-                n = m_type.declarators[0][0]
-                if n is None:
-                    raise Exception("Can't determine size of field: {}".format(spec))
+            # Locate the fields of this member
+            m_offset = struct.calcsize('<' + format_str + m_padding)
+            if m_fields is None:
+                fields.append((m_name, m_format_str, n, m_offset))
             else:
-                n = 1
+                m_size = struct.calcsize('<' + m_format_str)
+                for i in range(n):
+                    m_path = m_name if n == 1 else '{}[{}]'.format(m_name, i)
+                    fields.extend(
+                            (m_path + '.' + f_path, f_format, f_n, m_offset + i*m_size + f_offset)
+                            for f_path, f_format, f_n, f_offset in m_fields)
 
             # Accumulate format string
             format_str += m_padding + (m_format_str * n)
@@ -295,7 +442,35 @@ class Formatter(object):
 
         format_str += get_padding(struct.calcsize(format_str), max_elem_alignment)
 
-        return format_str
+        # Keep a reference to the spec so its id isn't reused
+        self.layouts[key] = (spec, (format_str, fields))
+
+        return format_str, fields
+
+_formatters = weakref.WeakValueDictionary()
+_formatters_lock = threading.Lock()
+
+def get_formatter(type_specs, payload_endianness='little'):
+    """
+    get a Formatter for the given type specs and endianness
+
+    Formatters are shared by all users of the same type specs and
+    endianness, so the types are only resolved once. A new formatter is
+    created if types have been added to the type specs since.
+    """
+
+    key = (id(type_specs), payload_endianness)
+
+    with _formatters_lock:
+        formatter = _formatters.get(key, None)
+
+        if (formatter is None
+                or formatter.specs is not type_specs
+                or formatter.n_specs != len(type_specs._fw)):
+            formatter = Formatter(type_specs, payload_endianness)
+            _formatters[key] = formatter
+
+    return formatter
 
 class CommandFactory(object):
     """
@@ -306,7 +481,7 @@ class CommandFactory(object):
         """
         spacecraft_endianness: little/big
         """
-        self.formatter = Formatter(type_specs, spacecraft_endianness)
+        self.formatter = get_formatter(type_specs, spacecraft_endianness)
 
     def pack(self, mid, cc, cstruct=None):
         """Create a command message"""
@@ -314,7 +489,7 @@ class CommandFactory(object):
         if cstruct is not None:
             payload = self.pack_struct(cstruct)
         else:
-            payload = ''
+            payload = b''
 
         header = self.pack_header(mid, cc, payload)
 
@@ -351,27 +526,28 @@ class CommandFactory(object):
 
         return ccsds_pri + ccsds_sec
 
-    def get_vector(self, type_spec, n_values, member_val):
+    def get_vector(self, m_format, n_values, member_val):
         """get a vector of values with zeros in all unspecified values"""
 
         # Specil null character for char arrays
-        null_vals = {'char': '\x00'}
+        null_vals = {'c': b'\x00'}
 
         # Construct a fixed-size array of zero values
-        val_padded = [null_vals.get(type_spec,0)] * n_values
+        val_padded = [null_vals.get(m_format,0)] * n_values
 
         # If the argument is provided, fill as much of the array as
         # provided
         if member_val is not None:
             arg_len = len(member_val)
             if arg_len > n_values:
-                raise ValueError("Argument {} too long. Max length: {}".format(m_name, n))
+                raise ValueError("Argument {} too long. Max length: {}".format(member_val, n_values))
 
             val_padded[0:arg_len] = member_val
 
             # Force utf-8 encoding
-            if type_spec == 'char':
-                val_padded = [bytes(v.encode('utf-8')) for v in val_padded]
+            if m_format == 'c':
+                val_padded = [v if isinstance(v, bytes) else bytes(v.encode('utf-8'))
+                        for v in val_padded]
 
         return val_padded
 
@@ -384,17 +560,15 @@ class CommandFactory(object):
         # This populates the values aray
         for m_name, m_type, _ in cstruct.spec.members:
 
-            # Get the member value if populated
-            member_val = cstruct.members.get(m_name, None)
+            # Get the member value if populated, attributes set on decoded
+            # structs take precedence so that they can be edited
+            member_val = cstruct.__dict__.get(m_name, cstruct.members.get(m_name, None))
 
-            # Get the number of values for this field
-            n_values = (
-                    m_type.declarators[0][0]
-                    if (len(m_type.declarators) > 0)
-                    else 1)
+            # Get the type and number of values for this field
+            m_format, spec, n_values = self.formatter.resolve_member(m_type)
 
             # Handle primitives or other CStructs
-            if m_type.type_spec in self.formatter.primitives:
+            if spec is None:
                 # Determine if this member is scalar or vector
                 if n_values == 1:
                     # Zero or the provided value
@@ -403,13 +577,10 @@ class CommandFactory(object):
                     # Extend with a vector of values
                     values.extend(
                             self.get_vector(
-                                m_type.type_spec,
+                                m_format,
                                 n_values,
                                 member_val))
             else:
-
-                spec = self.formatter.specs._fw[m_type.type_spec]
-
                 if n_values == 1:
                     if member_val is None:
                         member_val = CStruct(spec)
@@ -452,13 +623,100 @@ class CommandFactory(object):
         return struct.pack(self.formatter.payload_endianness + spec_format, *field_values)
 
 
+class Projection(object):
+    """
+    decoder for a subset of the fields of a telemetry message
+
+    The location of each requested field is computed once from the struct
+    layout, so decoding a message only unpacks the requested fields instead
+    of the whole struct.
+
+    The struct is the payload of the message, i.e. the bytes after the
+    telemetry header. Fields are named by their dotted path in the struct
+    (see Formatter.get_layout), optionally with an index into a primitive
+    array (e.g. 'Voltages[3]'). Scalar fields decode to a single value,
+    char arrays to a bytestring and other arrays to a tuple.
+    """
+    def __init__(self, formatter, spec, fields, as_dict=False,
+            offset=CCSDS.PRI.SIZE + cFS.TLM.SEC.SIZE + cFS.TLM.SEC.PADDING):
+        """
+        formatter: Formatter for the message types
+        spec: struct specification of the message payload, after the
+            telemetry header
+        fields: list of field paths to decode
+        as_dict: decode to a dict keyed by field path instead of a tuple
+        offset: offset of the struct in the message
+        """
+
+        _, layout = formatter.get_layout(spec, padding=True)
+        layout = {f_path: (f_format, f_n, f_offset)
+                for f_path, f_format, f_n, f_offset in layout}
+
+        self.spec = spec
+        self.fields = list(fields)
+        self.as_dict = as_dict
+        self.size = offset + struct.calcsize(formatter.get_format(spec))
+
+        # (unpack function, offset, scalar) and struct format for each field
+        self.unpackers = []
+        self.formats = []
+
+        for field in self.fields:
+            index = None
+            path = field
+
+            if path not in layout and path.endswith(']') and '[' in path:
+                path, index = path[:-1].rsplit('[', 1)
+                index = int(index)
+
+            if path not in layout:
+                raise ValueError("Unknown field for struct {}: {}".format(spec, field))
+
+            f_format, f_n, f_offset = layout[path]
+
+            if index is not None:
+                if index >= f_n:
+                    raise ValueError("Index out of range for field {} of size {}".format(field, f_n))
+                f_offset += index * struct.calcsize(f_format)
+                f_n = 1
+
+            if f_n == 1:
+                f_struct_format = formatter.payload_endianness + f_format
+            elif f_format == 'c':
+                f_struct_format = '{}{}s'.format(formatter.payload_endianness, f_n)
+                f_n = 1
+            else:
+                f_struct_format = '{}{}{}'.format(formatter.payload_endianness, f_n, f_format)
+
+            f_struct = struct.Struct(f_struct_format)
+
+            self.unpackers.append((f_struct.unpack_from, offset + f_offset, f_n == 1))
+            self.formats.append(f_struct_format)
+
+    def unpack(self, data):
+        """decode the requested fields from a message"""
+
+        if len(data) < self.size:
+            raise ValueError("Message of size {} too short for {} (size: {})".format(
+                len(data), self.spec, self.size))
+
+        values = tuple(
+                unpack_from(data, offset)[0] if scalar else unpack_from(data, offset)
+                for unpack_from, offset, scalar in self.unpackers)
+
+        if self.as_dict:
+            return dict(zip(self.fields, values))
+
+        return values
+
+
 class TelemetryFactory(object):
     """
     telemetry factory is used to construct CStruct objects from telemetry
     message bytestrings
     """
     def __init__(self, type_specs, spacecraft_endianness='little'):
-        self.formatter = Formatter(type_specs, spacecraft_endianness)
+        self.formatter = get_formatter(type_specs, spacecraft_endianness)
 
     def unpack_header(self, data):
         # Unpack the header
@@ -482,6 +740,37 @@ class TelemetryFactory(object):
 
         return pri_id, pri_seq, pri_data_len, stamp
 
+    def pack_header(self, mid, payload_size, stamp=(0, 0), sequence=0):
+        """
+        Create the header for an unsegmented telemetry message given the
+        payload size and a (seconds, subseconds) time stamp
+        """
+
+        # Construct primary header
+        ccsds_pri = struct.pack(
+                CCSDS.PRI.FORMAT,
+                # Version and identification
+                (CCSDS.PRI.VERSION_1 |
+                    CCSDS.PRI.PKT_TYPE_TLM |
+                    CCSDS.PRI.HAS_SEC_HEADER |
+                    (CCSDS.PRI.MASK_APID & mid)),
+                # Sequence information
+                (CCSDS.PRI.SEQUENCE_UNSEGMENTED |
+                    (CCSDS.PRI.MASK_SEQUENCE_NUMBER & sequence)),
+                # Total data bytes -1 (ref: CCSDS 133.0-B-2 Section 4.1.3.5.3)
+                cFS.TLM.SEC.SIZE + cFS.TLM.SEC.PADDING + payload_size - 1)
+
+        # Construct secondary header
+        ccsds_sec = struct.pack(
+                cFS.TLM.SEC.FORMAT,
+                stamp[0],
+                stamp[1])
+
+        return ccsds_pri + ccsds_sec + b'\x00' * cFS.TLM.SEC.PADDING
+
+    def make_projection(self, spec, fields, as_dict=False):
+        """get a Projection which decodes only the given fields of spec"""
+        return Projection(self.formatter, spec, fields, as_dict=as_dict)
 
     def unpack_payload(self, data, spec):
 
@@ -0,0 +1,292 @@
+from __future__ import print_function
+
+import os
+import time
+import heapq
+import socket
+import struct
+import select
+import threading
+
+from .serialization import CCSDS, cFS, CStruct, CommandFactory, TelemetryFactory
+
+# Value ranges of the integer formats, used to wrap ramps and counters
+INT_RANGES = {
+        'b': (-0x80, 0x7F),
+        'B': (0, 0xFF),
+        'h': (-0x8000, 0x7FFF),
+        'H': (0, 0xFFFF),
+        'i': (-0x80000000, 0x7FFFFFFF),
+        'I': (0, 0xFFFFFFFF),
+        'q': (-0x8000000000000000, 0x7FFFFFFFFFFFFFFF),
+        'Q': (0, 0xFFFFFFFFFFFFFFFF),
+        }
+
+def ramp_value(format_char, k):
+    """get the k-th value of a ramp for a given format"""
+    if format_char in INT_RANGES:
+        # Count up from 0, wrapping around into the range of the type
+        low, high = INT_RANGES[format_char]
+        value = k % (high - low + 1)
+        return value - (high - low + 1) if value > high else value
+    elif format_char == 'c':
+        return bytes(bytearray([ord('a') + k % 26]))
+    elif format_char == '?':
+        return bool(k % 2)
+    else:
+        return float(k)
+
+class TelemetryStream(object):
+    """
+    a periodic stream of synthetic telemetry messages for one MID
+
+    values is one of:
+        'random': random bytes for the whole payload
+        'ramp': every field counts up by one with each message
+        a list of CStructs or payload bytestrings, which are replayed in order
+    """
+    def __init__(self, cfac, tfac, mid, spec, rate=1.0, burst=1, values='random'):
+        """
+        rate: bursts per second
+        burst: messages sent back-to-back in each burst
+        """
+
+        self.mid = mid
+        self.spec = spec
+        self.period = 1.0 / rate
+        self.burst = burst
+        self.values = values
+
+        formatter = cfac.formatter
+        format_str, self.layout = formatter.get_layout(spec)
+        self.payload_struct = struct.Struct(formatter.payload_endianness + format_str)
+        self.format_chars = [f for f in format_str if f != 'x']
+
+        self.tfac = tfac
+        self.header_size = CCSDS.PRI.SIZE + cFS.TLM.SEC.SIZE + cFS.TLM.SEC.PADDING
+        self.buffer = bytearray(self.header_size + self.payload_struct.size)
+
+        # Pack replayed values once up front
+        if values in ('random', 'ramp'):
+            self.replay = None
+        else:
+            self.replay = [
+                    cfac.pack_struct(v) if isinstance(v, CStruct) else bytes(v)
+                    for v in values]
+            for payload in self.replay:
+                if len(payload) != self.payload_struct.size:
+                    raise ValueError("Replayed payload of size {} doesn't match {} (size: {})".format(
+                        len(payload), spec, self.payload_struct.size))
+
+        # Fields overridden in every message: (pack_into, offset, get_value)
+        self.overrides = []
+
+        self.sequence = 0
+        self.n_sent = 0
+
+    def override(self, field, get_value):
+        """set a primitive field to get_value() in every message"""
+
+        for f_path, f_format, f_n, f_offset in self.layout:
+            if f_path == field and f_n == 1:
+                f_struct = struct.Struct(self.payload_struct.format[0:1] + f_format)
+
+                if f_format in INT_RANGES:
+                    low, high = INT_RANGES[f_format]
+                    value_fn = lambda: low + ((get_value() - low) % (high - low + 1))
+                else:
+                    value_fn = get_value
+
+                self.overrides.append((f_struct.pack_into,
+                    self.header_size + f_offset, value_fn))
+                return
+
+        raise ValueError("Unknown scalar field for struct {}: {}".format(self.spec, field))
+
+    def next_message(self, now):
+        """build the next message in the stream"""
+
+        buf = self.buffer
+
+        if self.replay is not None:
+            buf[self.header_size:] = self.replay[self.n_sent % len(self.replay)]
+        elif self.values == 'ramp':
+            self.payload_struct.pack_into(buf, self.header_size,
+                    *[ramp_value(f, self.n_sent) for f in self.format_chars])
+        else:
+            buf[self.header_size:] = os.urandom(self.payload_struct.size)
+
+        for pack_into, offset, get_value in self.overrides:
+            pack_into(buf, offset, get_value())
+
+        seconds = int(now)
+        subseconds = int((now - seconds) * 0x10000) & 0xFFFF
+        buf[0:self.header_size] = self.tfac.pack_header(self.mid,
+                self.payload_struct.size,
+                (seconds, subseconds),
+                self.sequence)
+
+        self.sequence = (self.sequence + 1) & CCSDS.PRI.MASK_SEQUENCE_NUMBER
+        self.n_sent += 1
+
+        return buf
+
+class Simulator(object):
+    """
+    local stand-in for a cFS target
+
+    Sends synthetic telemetry streams to host:port and optionally accepts
+    commands on cmd_port, counting valid and invalid commands for each
+    command MID. These counters can be echoed in housekeeping streams.
+    """
+    def __init__(self, host, port, type_specs, endianness='little',
+            cmd_host='0.0.0.0', cmd_port=None, max_size=8192):
+
+        self.host = host
+        self.port = port
+
+        self.MAX_MSG_SIZE = max_size
+
+        self.cfac = CommandFactory(type_specs, endianness)
+        self.tfac = TelemetryFactory(type_specs, endianness)
+
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+        if cmd_port is not None:
+            self.cmd_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.cmd_socket.bind((cmd_host, cmd_port))
+        else:
+            self.cmd_socket = None
+
+        self.streams = []
+
+        # Command counters by MID: [valid, invalid]
+        self.cmd_counters = {}
+
+        self.running = True
+        self.threads = [threading.Thread(target=self.telemetry_thread)]
+        if self.cmd_socket is not None:
+            self.threads.append(threading.Thread(target=self.command_thread))
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+
+    def shutdown(self):
+        print('Shutting down Simulator...')
+        self.running = False
+        for thread in self.threads:
+            thread.join()
+        self.socket.close()
+        if self.cmd_socket is not None:
+            self.cmd_socket.close()
+
+    def add_stream(self, mid, spec, rate=1.0, burst=1, values='random'):
+        """
+        send messages with message id mid and payload spec at rate bursts per
+        second with burst messages each, starting immediately if the
+        simulator is already running
+
+        see TelemetryStream for the supported values
+
+        returns the TelemetryStream
+        """
+
+        stream = TelemetryStream(self.cfac, self.tfac, mid, spec,
+                rate=rate, burst=burst, values=values)
+        self.streams.append(stream)
+
+        return stream
+
+    def add_housekeeping(self, mid, spec, cmd_mid, rate=1.0,
+            counter_field='CommandCounter',
+            error_field='CommandErrorCounter',
+            values='ramp'):
+        """
+        send housekeeping messages which report the command counters for
+        cmd_mid
+
+        returns the TelemetryStream
+        """
+
+        counters = self.cmd_counters.setdefault(cmd_mid, [0, 0])
+
+        stream = self.add_stream(mid, spec, rate=rate, values=values)
+        if counter_field is not None:
+            stream.override(counter_field, lambda: counters[0])
+        if error_field is not None:
+            stream.override(error_field, lambda: counters[1])
+
+        return stream
+
+    def telemetry_thread(self):
+
+        print('Starting simulator telemetry thread...')
+
+        schedule = []
+
+        while self.running:
+            # Schedule streams added since the last pass, including after
+            # the simulator was started
+            for i in range(len(schedule), len(self.streams)):
+                heapq.heappush(schedule, (time.time(), i))
+
+            if len(schedule) == 0:
+                time.sleep(0.1)
+                continue
+
+            deadline, i = schedule[0]
+
+            now = time.time()
+            if deadline > now:
+                time.sleep(min(deadline - now, 0.1))
+                continue
+
+            stream = self.streams[i]
+            for j in range(stream.burst):
+                self.socket.sendto(stream.next_message(now), (self.host, self.port))
+
+            # Schedule relative to the deadline to avoid drift
+            heapq.heapreplace(schedule, (deadline + stream.period, i))
+
+        print('Simulator telemetry thread terminated.')
+
+    def command_thread(self):
+
+        print('Starting simulator command thread...')
+
+        while self.running:
+            readable, writable, exceptional = select.select([self.cmd_socket],[],[], 1.0)
+            if not readable:
+                continue
+
+            data, sender_addr = self.cmd_socket.recvfrom(self.MAX_MSG_SIZE)
+
+            self.process_command(data)
+
+        print('Simulator command thread terminated.')
+
+    def process_command(self, data):
+        """update the command counters for a received command"""
+
+        header_size = CCSDS.PRI.SIZE + cFS.CMD.SEC.SIZE
+
+        if len(data) < header_size:
+            print('ERROR: Command of size {} too short'.format(len(data)))
+            return
+
+        pri_id, pri_seq, pri_data_len = struct.unpack_from(CCSDS.PRI.FORMAT, data, 0)
+        cc, checksum = struct.unpack_from(cFS.CMD.SEC.FORMAT, data, CCSDS.PRI.SIZE)
+
+        mid = pri_id
+        counters = self.cmd_counters.setdefault(mid, [0, 0])
+
+        valid = (
+                (pri_id & CCSDS.PRI.BIT_PKT_TYPE) == CCSDS.PRI.PKT_TYPE_CMD
+                and CCSDS.PRI.SIZE + pri_data_len + 1 == len(data)
+                and cFS.compute_checksum(data[header_size:]) == checksum)
+
+        if valid:
+            counters[0] += 1
+        else:
+            counters[1] += 1
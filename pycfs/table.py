@@ -0,0 +1,249 @@
+from __future__ import print_function
+
+import struct
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from .serialization import NUMPY_FORMATS, CStruct, CommandFactory
+
+class TableHeader(object):
+    """
+    the cFE file header and table header of a table image
+
+    ref: CFE_FS_Header_t and CFE_TBL_File_Hdr_t
+    """
+
+    # cFE file header, always big endian
+    FS_FORMAT = '>IIIIIIII32s'
+    FS_SIZE = 64
+    FS_CONTENT_TYPE = 0x63464531 # 'cFE1'
+    FS_SUBTYPE_TBL_IMG = 8
+
+    # Table header, always big endian
+    TBL_FORMAT = '>III{}s'
+
+    def __init__(self, table_name='', description='', spacecraft_id=0,
+            processor_id=0, application_id=0, stamp=(0, 0), offset=0,
+            num_bytes=0, subtype=FS_SUBTYPE_TBL_IMG):
+        """
+        table_name: full table name, e.g. 'SAMPLE_APP.SampleTable'
+        stamp: (seconds, subseconds) creation time
+        offset: byte offset of the data in the table
+        num_bytes: number of bytes of table data
+        """
+        self.table_name = table_name
+        self.description = description
+        self.spacecraft_id = spacecraft_id
+        self.processor_id = processor_id
+        self.application_id = application_id
+        self.stamp = stamp
+        self.offset = offset
+        self.num_bytes = num_bytes
+        self.subtype = subtype
+
+    def __repr__(self):
+        return 'TableHeader({})'.format(', '.join(
+            '{}={!r}'.format(k, v) for k, v in sorted(self.__dict__.items())))
+
+class TableCodec(object):
+    """
+    encodes and decodes cFE table images (.tbl files)
+
+    The table data is an array of entries of a given struct type, which is a
+    single entry for tables which aren't arrays. Entries are packed and
+    unpacked in bulk, as NumPy structured arrays when NumPy is available,
+    otherwise with one precompiled struct per entry.
+    """
+    def __init__(self, type_specs, spacecraft_endianness='little',
+            table_name_size=40, use_numpy=True):
+        """
+        table_name_size: CFE_MISSION_TBL_MAX_FULL_NAME_LEN for the mission
+        use_numpy: use NumPy when it is available
+        """
+        self.cfac = CommandFactory(type_specs, spacecraft_endianness)
+        self.formatter = self.cfac.formatter
+
+        self.use_numpy = use_numpy and np is not None
+
+        self.fs_struct = struct.Struct(TableHeader.FS_FORMAT)
+        self.tbl_struct = struct.Struct(TableHeader.TBL_FORMAT.format(table_name_size))
+        self.header_size = self.fs_struct.size + self.tbl_struct.size
+
+    def get_entry_struct(self, spec):
+        """get the precompiled struct for one table entry"""
+        return struct.Struct(self.formatter.payload_endianness + self.formatter.get_format(spec))
+
+    def get_dtype(self, spec):
+        """
+        get the NumPy dtype for one table entry
+
+        Fields are named by their dotted path (see Formatter.get_layout).
+        """
+        if np is None:
+            raise Exception("NumPy is not available.")
+
+        format_str, layout = self.formatter.get_layout(spec)
+
+        names, formats, offsets = [], [], []
+        for f_path, f_format, f_n, f_offset in layout:
+            if f_format == 'c':
+                f_dtype = 'S{}'.format(f_n)
+            elif f_n == 1:
+                f_dtype = self.formatter.payload_endianness + NUMPY_FORMATS[f_format]
+            else:
+                f_dtype = (self.formatter.payload_endianness + NUMPY_FORMATS[f_format], (f_n,))
+
+            names.append(f_path)
+            formats.append(f_dtype)
+            offsets.append(f_offset)
+
+        return np.dtype({
+            'names': names,
+            'formats': formats,
+            'offsets': offsets,
+            'itemsize': struct.calcsize('<' + format_str)})
+
+    def pack_entries(self, spec, entries):
+        """
+        pack table entries into bytes
+
+        entries is a NumPy structured array, or a list of CStructs or of
+        tuples of flat field values (as returned by unpack_entries)
+        """
+
+        if np is not None and isinstance(entries, np.ndarray):
+            # Start from zeros so that padding bytes are deterministic
+            packed = np.zeros(len(entries), dtype=self.get_dtype(spec))
+            packed[:] = entries
+            return packed.tobytes()
+
+        entry_struct = self.get_entry_struct(spec)
+        data = bytearray(entry_struct.size * len(entries))
+
+        pack_into = entry_struct.pack_into
+        for i, entry in enumerate(entries):
+            if isinstance(entry, CStruct):
+                entry = self.cfac.get_fields(entry)
+            pack_into(data, i * entry_struct.size, *entry)
+
+        return bytes(data)
+
+    def unpack_entries(self, spec, data, as_cstructs=False):
+        """
+        unpack all the table entries in data
+
+        returns a writable NumPy structured array when NumPy is used,
+        otherwise a list of tuples of flat field values, or a list of
+        CStructs if as_cstructs is set
+        """
+
+        entry_struct = self.get_entry_struct(spec)
+        if len(data) % entry_struct.size != 0:
+            raise ValueError("Table data of size {} is not a whole number of {} entries (size: {})".format(
+                len(data), spec, entry_struct.size))
+
+        n_entries = len(data) // entry_struct.size
+
+        if self.use_numpy and not as_cstructs:
+            # Copy so that the entries can be modified
+            return np.frombuffer(data, dtype=self.get_dtype(spec), count=n_entries).copy()
+
+        unpack_from = entry_struct.unpack_from
+        entries = [unpack_from(data, i * entry_struct.size) for i in range(n_entries)]
+
+        if as_cstructs:
+            entries = [self.formatter.make_cstruct(fields, spec)[0] for fields in entries]
+
+        return entries
+
+    def encode(self, header, spec, entries):
+        """create a table image from a TableHeader and table entries"""
+
+        data = self.pack_entries(spec, entries)
+
+        fs_header = self.fs_struct.pack(
+                TableHeader.FS_CONTENT_TYPE,
+                header.subtype,
+                TableHeader.FS_SIZE,
+                header.spacecraft_id,
+                header.processor_id,
+                header.application_id,
+                header.stamp[0],
+                header.stamp[1],
+                header.description.encode('utf-8'))
+
+        tbl_header = self.tbl_struct.pack(
+                0,
+                header.offset,
+                len(data),
+                header.table_name.encode('utf-8'))
+
+        return fs_header + tbl_header + data
+
+    def decode(self, data, spec, as_cstructs=False):
+        """
+        read a table image
+
+        returns (TableHeader, entries), see unpack_entries for the entries
+        """
+
+        if len(data) < self.header_size:
+            raise ValueError("Table image of size {} too short for headers (size: {})".format(
+                len(data), self.header_size))
+
+        (content_type, subtype, length, spacecraft_id, processor_id,
+                application_id, seconds, subseconds,
+                description) = self.fs_struct.unpack_from(data, 0)
+
+        if content_type != TableHeader.FS_CONTENT_TYPE:
+            raise ValueError("Not a cFE file, content type: 0x{:08x}".format(content_type))
+
+        reserved, offset, num_bytes, table_name = self.tbl_struct.unpack_from(
+                data, self.fs_struct.size)
+
+        header = TableHeader(
+                table_name=table_name.split(b'\x00', 1)[0].decode('utf-8'),
+                description=description.split(b'\x00', 1)[0].decode('utf-8'),
+                spacecraft_id=spacecraft_id,
+                processor_id=processor_id,
+                application_id=application_id,
+                stamp=(seconds, subseconds),
+                offset=offset,
+                num_bytes=num_bytes,
+                subtype=subtype)
+
+        if len(data) < self.header_size + num_bytes:
+            raise ValueError("Table image truncated, expected {} bytes of data but got {}".format(
+                num_bytes, len(data) - self.header_size))
+
+        table_data = memoryview(data)[self.header_size:self.header_size + num_bytes]
+
+        return header, self.unpack_entries(spec, table_data, as_cstructs=as_cstructs)
+
+    def write(self, path, header, spec, entries):
+        """write a table image file"""
+        with open(path, 'wb') as table_file:
+            table_file.write(self.encode(header, spec, entries))
+
+    def read(self, path, spec, as_cstructs=False):
+        """read a table image file"""
+        with open(path, 'rb') as table_file:
+            return self.decode(table_file.read(), spec, as_cstructs=as_cstructs)
+
+    def diff(self, entries_a, entries_b):
+        """get the indices of the entries which differ between two tables"""
+
+        if np is not None and isinstance(entries_a, np.ndarray) and isinstance(entries_b, np.ndarray):
+            n = min(len(entries_a), len(entries_b))
+            changed = np.nonzero(entries_a[:n] != entries_b[:n])[0].tolist()
+        else:
+            changed = [i for i, (a, b) in enumerate(zip(entries_a, entries_b)) if a != b]
+
+        # Entries only in one of the tables
+        changed.extend(range(min(len(entries_a), len(entries_b)),
+            max(len(entries_a), len(entries_b))))
+
+        return changed
@@ -9,4 +9,7 @@ setup(
         'pyclibrary',
         'IPython'
         ],
+    extras_require={
+        'numpy': ['numpy'],
+        },
     scripts=['scripts/cfssh'])